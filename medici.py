@@ -1,6 +1,11 @@
 from enum import IntEnum, Enum
-from typing import NamedTuple, Union, Optional
-from random import shuffle, choice
+from typing import NamedTuple, Union, Optional, Tuple
+from dataclasses import dataclass
+from functools import cached_property
+import random
+import time
+from array import array
+from collections import OrderedDict
 
 class Phase(IntEnum):
     Draw = 0
@@ -22,6 +27,14 @@ class DrawAction(IntEnum):
 class BidAction(NamedTuple):
     value: int # 0 for pass
 
+# interned bid actions, indexed by value
+bid_actions = [BidAction(i) for i in range(256)]
+
+def bid_action(value):
+    while value >= len(bid_actions):
+        bid_actions.append(BidAction(len(bid_actions)))
+    return bid_actions[value]
+
 class Type(IntEnum):
     Cloth   = 0
     Fur     = 1
@@ -44,6 +57,183 @@ class Card(NamedTuple):
     def __repr__(self):
         return str(self)
 
+class LogMode(IntEnum):
+    Off = 0
+    Structured = 1 # events recorded as ints, rendered on demand
+    Text = 2
+
+class EventType(IntEnum):
+    # the actor of an event is a bitmask of players; values a, b, c follow
+    Pass = 0
+    Draw = 1 # a: card kind
+    Bid = 2 # a: bid
+    CompleteShip = 3 # a: cards added from the deck
+    ShipValueFirst = 4 # a: reward, b: ship value
+    ShipValueSecond = 5 # a: reward, b: ship value
+    ShipValueThird = 6 # a: reward, b: ship value
+    ShipValueTiedSecond = 7 # a: reward
+    ShipValueTiedFirst = 8 # a: reward
+    ShipValueSecondAfterTie = 9 # a: reward
+    ShipValueTiedAll = 10 # a: reward
+    PyramidFirst = 11 # a: reward, b: resource
+    PyramidSecond = 12 # a: reward, b: resource
+    PyramidTiedFirst = 13 # a: reward, b: resource
+    PyramidBonus = 14 # a: bonus, b: resource, c: purchases
+
+kEventWidth = 5 # actor, type, a, b, c
+kEventCapacity = 256 # events preallocated per state; grows by doubling
+
+# change journal entries, each a tuple starting with one of these
+kUndoAction = 0 # the scalars before an action
+kUndoPop = 1 # a card popped from the deck
+kUndoInPlay = 2 # a card added to the lot
+kUndoBid = 3 # a bid, with the player's previous bid (-1 for none)
+kUndoWin = 4 # an auction win, with the winning bid and previous pyramid leaders
+kUndoFill = 5 # cards dealt to a ship by CompleteShip
+kUndoLot = 6 # the lot and bids replaced after an auction
+kUndoDay = 7 # the containers replaced at the end of a day
+
+def players_mask(players):
+    mask = 0
+    for player in players:
+        mask |= 1 << player
+    return mask
+
+def render_event(game, actor, event_type, a=0, b=0, c=0):
+    players = [player for player in range(game.n_players) if actor >> player & 1]
+    player = players[0]
+
+    if event_type == EventType.Pass:
+        return f"Player {player} passes."
+    elif event_type == EventType.Draw:
+        return f"Player {player} draws a {str(game.card_kinds[a])}."
+    elif event_type == EventType.Bid:
+        return f"Player {player} bids ${a}."
+    elif event_type == EventType.CompleteShip:
+        return f"Player {player}'s ship is filled with {a} card(s) from the deck."
+    elif event_type == EventType.ShipValueFirst:
+        return f"Player {player} gets ${a} for having the highest ship value ({b})."
+    elif event_type == EventType.ShipValueSecond:
+        return f"Player {player} gets ${a} for having the second highest ship value ({b})."
+    elif event_type == EventType.ShipValueThird:
+        if len(players) == 1:
+            return f"Player {player} gets ${a} for having the third highest ship value ({b})."
+        return f"Players {str(players)} get ${a} for having the third highest ship value ({b})."
+    elif event_type == EventType.ShipValueTiedSecond:
+        if len(players) == 2:
+            return f"Players {players[0]} and {players[1]} get ${a} for having the second highest ship value."
+        return f"Players {str(players)} get ${a} for having the second highest ship value."
+    elif event_type == EventType.ShipValueTiedFirst:
+        return f"Players {players[0]} and {players[1]} get ${a} for having the third highest ship value."
+    elif event_type == EventType.ShipValueSecondAfterTie:
+        if len(players) == 1:
+            return f"Player {player} gets ${a} for having the second highest ship value."
+        return f"Players {str(players)} get ${a} for having the second highest ship value."
+    elif event_type == EventType.ShipValueTiedAll:
+        return f"Players {str(players)} get ${a} for having the highest ship value."
+    elif event_type == EventType.PyramidFirst:
+        return f"Player {player} gets ${a} for having the most {type_strings[b]}."
+    elif event_type == EventType.PyramidSecond:
+        return f"Player(s) {players} get(s) ${a} for having the second most {type_strings[b]}."
+    elif event_type == EventType.PyramidTiedFirst:
+        return f"Player(s) {players} get(s) ${a} for purchasing the most {type_strings[b]}."
+    elif event_type == EventType.PyramidBonus:
+        return f"Player {player} gets ${a} for purchasing {c} {type_strings[b]}."
+
+def value_tiers(values, n_tiers):
+    """The players holding each of the `n_tiers` highest distinct values,
+    highest first; tiers past the number of distinct values are empty."""
+    tiers = [[] for _ in range(n_tiers)]
+    tier_values = []
+    for value in sorted(set(values), reverse=True)[:n_tiers]:
+        tier_values.append(value)
+    for player, value in enumerate(values):
+        for tier, tier_value in enumerate(tier_values):
+            if value == tier_value:
+                tiers[tier].append(player)
+                break
+    return tiers
+
+# integer action ids: Draw, Pass, then a bid of v as 2 + v (so 2 passes a bid)
+kDrawActionId = 0
+kPassActionId = 1
+kBidActionIdOffset = 2
+
+def encode_action(action):
+    if isinstance(action, BidAction):
+        return kBidActionIdOffset + action.value
+    return int(action)
+
+def decode_action(action_id):
+    if action_id < kBidActionIdOffset:
+        return DrawAction(action_id)
+    return bid_action(action_id - kBidActionIdOffset)
+
+def random_index(rng, n):
+    """Uniform index below n from a `random.Random`, a NumPy Generator, or
+    the global random module if rng is None."""
+    if rng is None:
+        return random.randrange(n)
+    integers = getattr(rng, "integers", None)
+    if integers is not None:
+        return int(integers(n))
+    return rng.randrange(n)
+
+class ZobristKeys:
+    """Random 64-bit keys for hashing MediciState positions.
+
+    Cards are hashed as multisets: the n-th copy of a card kind in a ship,
+    the lot or the deck has its own key, so card order does not matter.
+    """
+
+    def __init__(self, rules, seed=0x5EED):
+        rng = random.Random(seed)
+
+        def keys(*shape):
+            if len(shape) == 1:
+                return [rng.getrandbits(64) for _ in range(shape[0])]
+            return [keys(*shape[1:]) for _ in range(shape[0])]
+
+        p = rules.n_players
+        n_kinds = len(rules.card_kinds)
+        copies = max(rules.all_cards.count(card) for card in rules.card_kinds)
+
+        self.money = keys(p, rules.max_money + 1)
+        self.bid = keys(p, rules.max_bid + 1)
+        self.ship = keys(p, n_kinds, copies)
+        self.pyramid = keys(Type.Gold, p, rules.max_purchases + 1)
+        self.cards_in_play = keys(n_kinds, copies)
+        self.deck = keys(n_kinds, copies)
+        self.day = keys(rules.n_days)
+        self.phase = keys(len(Phase))
+        self.current_player = keys(p)
+        self.turn_player = keys(p)
+        self.action = keys(rules.num_distinct_actions)
+
+
+class TranspositionTable:
+    """A bounded map from position hashes to search statistics that evicts
+    the least recently used entry."""
+
+    def __init__(self, capacity=1 << 20):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def Lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def Store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
 # class MediciFrontendHelper:
 #     def __init__(self):
 #         pass
@@ -52,33 +242,119 @@ class Card(NamedTuple):
 
 
 class MediciState:
-    def __init__(self, game):
+    __slots__ = (
+        "game", "turn_player", "current_player", "phase", "bids", "money",
+        "cards_in_play", "deck", "ships", "pyramids", "day", "is_game_over",
+        "winner", "logs", "rng",
+        "version", "dirty_players", "dirty_pyramids", "frontend_history",
+        "frontend_cache", "ship_values", "n_full_ships", "pyramid_top",
+        "pyramid_second", "high_bid", "zobrist", "deck_counts", "deck_value", "log_mode",
+        "events", "n_events", "journal", "ship_capacity", "max_lot_size",
+    )
+
+    def __init__(self, game, rng=None):
         self.game = game
+        # used for every shuffle; None means the global random module
+        self.rng = rng
+        self.journal = None # a change journal for UndoAction, once started
+        # rules the hot paths read, kept here to save a lookup through game
+        self.ship_capacity = game.kShipCapacity
+        self.max_lot_size = game.kMaxLotSize
         self.turn_player = 0 # first buyer in turn
         self.current_player = 0  
         self.phase = Phase.Draw
         self.bids = {}
-        self.money = [40] * game.n_players
+        self.high_bid = 0 # highest bid in the current auction
+        self.money = [game.kStartingMoney] * game.n_players
         self.cards_in_play = []
-        self.deck = game.all_cards.copy()
-        shuffle(self.deck)
+        self.zobrist = 0 # computed in full once the state is set up
+        self.SetDeck(game.ShuffledDeck(self.rng))
 
         self.cards_in_play = []
-        self.cards_in_play.append(self.deck.pop())
+        self.cards_in_play.append(self.PopDeck())
 
         self.ships = []
         for i in range(self.game.n_players):
             self.ships.append([])
 
-        self.pyramids = {}
-        for resource in [Type.Cloth, Type.Fur, Type.Grain, Type.Dye, Type.Spice]:
-            self.pyramids[resource] = [0] * self.game.n_players
+        # purchase counts indexed by resource type, then by player
+        self.pyramids = [[0] * self.game.n_players for _ in range(Type.Gold)]
+
+        # running totals kept up to date by CompleteAuction and CompleteShip:
+        # each ship's value, the number of full ships, and per resource the
+        # highest purchase count and the highest count below it
+        self.ship_values = [0] * self.game.n_players
+        self.n_full_ships = 0
+        self.pyramid_top = [0] * Type.Gold
+        self.pyramid_second = [0] * Type.Gold
 
         self.day = 0
         self.is_game_over = False
         self.winner = None
 
+        # text mode renders into logs as it goes; structured mode records
+        # kEventWidth ints per event
+        self.log_mode = game.log_mode
         self.logs = []
+        self.events = None
+        self.n_events = 0
+        if self.log_mode == LogMode.Structured:
+            self.events = array("i", [0]) * (kEventWidth * kEventCapacity)
+
+        # frontend bookkeeping: the version counts applied actions, and the
+        # dirty masks collect the players and pyramids each action touches
+        self.version = 0
+        self.dirty_players = 0
+        self.dirty_pyramids = 0
+        self.frontend_history = None # started by the first frontend request
+        self.frontend_cache = None
+
+        # Zobrist hash of everything but phase and players, which
+        # ZobristHash() folds in when asked
+        self.zobrist = self.ComputeZobrist()
+
+    def Clone(self, log_mode=LogMode.Off):
+        # Cards are immutable tuples, so copying the containers is enough.
+        # The clone starts with an empty log and, unless asked otherwise,
+        # does no logging, which is what searches want.
+        state = self.__class__.__new__(self.__class__)
+        state.game = self.game
+        state.turn_player = self.turn_player
+        state.current_player = self.current_player
+        state.phase = self.phase
+        state.bids = self.bids.copy()
+        state.high_bid = self.high_bid
+        state.zobrist = self.zobrist
+        state.deck_counts = self.deck_counts.copy()
+        state.deck_value = self.deck_value
+        state.money = self.money.copy()
+        state.cards_in_play = self.cards_in_play.copy()
+        state.deck = self.deck.copy()
+        state.ships = [ship.copy() for ship in self.ships]
+        state.pyramids = [counts.copy() for counts in self.pyramids]
+        state.ship_values = self.ship_values.copy()
+        state.n_full_ships = self.n_full_ships
+        state.pyramid_top = self.pyramid_top.copy()
+        state.pyramid_second = self.pyramid_second.copy()
+        state.day = self.day
+        state.is_game_over = self.is_game_over
+        state.winner = self.winner
+        state.log_mode = log_mode
+        state.logs = []
+        state.events = None
+        state.n_events = 0
+        state.journal = None
+        state.ship_capacity = self.ship_capacity
+        state.max_lot_size = self.max_lot_size
+        if log_mode == LogMode.Structured:
+            state.events = array("i", [0]) * (kEventWidth * kEventCapacity)
+        state.rng = self.rng
+        state.version = self.version
+        state.dirty_players = 0
+        state.dirty_pyramids = 0
+        state.frontend_history = None
+        state.frontend_cache = None
+        return state
 
     def frontend_action(self, action):
         if isinstance(action, BidAction):
@@ -105,98 +381,364 @@ class MediciState:
         else:
             return None
         
+    def Log(self, event_type, actor, a=0, b=0, c=0):
+        # callers check self.log_mode first, so LogMode.Off costs nothing
+        if self.log_mode == LogMode.Text:
+            self.logs.append(render_event(self.game, actor, event_type, a, b, c))
+        else:
+            events = self.events
+            i = self.n_events * kEventWidth
+            if i == len(events):
+                events.extend(events)
+            events[i] = actor
+            events[i + 1] = event_type
+            events[i + 2] = a
+            events[i + 3] = b
+            events[i + 4] = c
+            self.n_events += 1
+
+    def LogLength(self):
+        if self.events is not None:
+            return self.n_events
+        return len(self.logs)
+
+    def LogLines(self, start=0):
+        """Log lines from the `start`-th on, rendering structured events."""
+        if self.events is None:
+            return self.logs[start:]
+        events = self.events
+        return [render_event(self.game, *events[i:i + kEventWidth])
+                for i in range(start * kEventWidth, self.n_events * kEventWidth, kEventWidth)]
+
     def frontend_card(self, card):
         return (type_strings[int(card.type)], card.value)
 
-    def frontend_state(self):
-        cards_in_play = [self.frontend_card(card) for card in self.cards_in_play]
-        # for card in self.cards_in_play:
-            # cards_in_play.append((type_strings[int(card.type)], card.value))
-        ships = [[], [], [], [], []]
-        ship_totals = [0, 0, 0, 0, 0]
-        for i, ship in enumerate(self.ships):
-            ships[i] = [self.frontend_card(card) for card in ship]
-            ship_totals[i] = sum([card.value for card in ship])
+    def frontend_player(self, i):
+        ship = self.ships[i]
+        return {
+            "id": i,
+            "money": self.money[i],
+            "ship": [self.frontend_card(card) for card in ship],
+            "ship_total": self.ship_values[i],
+            "bid": self.bids[i] if i in self.bids else -1
+        }
 
-        players = []
-        for i in range(self.game.n_players):
-            players.append({
-                "id": i,
-                "money": self.money[i],
-                "ship": ships[i],
-                "ship_total": ship_totals[i],
-                "bid": self.bids[i] if i in self.bids else -1
-            })
+    def frontend_pyramid(self, resource):
+        pyramid = []
+        for i in range(self.game.n_pyramid_levels):
+            pyramid_level = []
+            for player in range(self.game.n_players):
+                if self.pyramids[resource][player] == i:
+                    pyramid_level.append(player)
+            pyramid.append(pyramid_level)
+        return pyramid
 
+    def frontend_common(self):
+        # the small fields every frontend payload carries
         raw_legal_actions = self.LegalActions()
         if raw_legal_actions:
             legal_actions = [self.frontend_action(action) for action in raw_legal_actions]
         else:
             legal_actions = []
 
-        pyramids = {}
-        for resource in [Type.Cloth, Type.Fur, Type.Grain, Type.Dye, Type.Spice]:
-            pyramid = []
-            for i in range(self.game.n_pyramid_levels):
-                pyramid_level = []
-                for player in range(self.game.n_players):
-                    if self.pyramids[resource][player] == i:
-                        pyramid_level.append(player)
-                pyramid.append(pyramid_level)
-            pyramids[type_strings[int(resource)]] = pyramid
-
-        logs = self.logs.copy()
-        logs.reverse()
-
         return {
+            "version": self.version,
             "day": self.day,
             "phase": phase_strings[self.phase],
             "turn_player": self.turn_player,
             "current_player": self.current_player,
-            "players": players,
-            "cards_in_play": cards_in_play,
-            "pyramids": pyramids,
+            "cards_in_play": [self.frontend_card(card) for card in self.cards_in_play],
             "legal_actions": legal_actions,
-            "deck": [self.frontend_card(card) for card in self.deck],
-            "logs": logs,
             "winner": self.winner,
             "is_game_over": self.is_game_over,
         }
+
+    def start_frontend_history(self):
+        if self.frontend_history is None:
+            # entry i describes version base + i: the players and pyramids
+            # it changed, and the log length, deck length and day after it
+            self.frontend_history = (self.version, [(0, 0, self.LogLength(), len(self.deck), self.day)])
+
+    def frontend_state(self):
+        # the snapshot is cached per version and shared by every caller, so
+        # it must not be modified
+        if self.frontend_cache is not None and self.frontend_cache[0] == self.version:
+            return self.frontend_cache[1]
+        self.start_frontend_history()
+
+        players = [self.frontend_player(i) for i in range(self.game.n_players)]
+
+        pyramids = {}
+        for resource in [Type.Cloth, Type.Fur, Type.Grain, Type.Dye, Type.Spice]:
+            pyramids[type_strings[int(resource)]] = self.frontend_pyramid(resource)
+
+        logs = self.LogLines()
+        logs.reverse()
+
+        state = self.frontend_common()
+        state.update({
+            "full": True,
+            # the frontend lays out seats and ship slots from these
+            "n_players": self.game.n_players,
+            "ship_capacity": self.ship_capacity,
+            "players": players,
+            "pyramids": pyramids,
+            "deck": [self.frontend_card(card) for card in self.deck],
+            "logs": logs,
+        })
+        self.frontend_cache = (self.version, state)
+        return state
+
+    def frontend_state_since(self, version):
+        """What changed after `version`, or a full snapshot if unknown.
+
+        A diff has "full": False, the small fields from `frontend_common`,
+        the changed players and pyramids, the number of cards popped from
+        the end of the deck and the new log lines, newest first. A new day
+        always produces a full snapshot.
+        """
+        if self.frontend_history is None:
+            return self.frontend_state()
+        base, history = self.frontend_history
+        if version < base or version > self.version:
+            return self.frontend_state()
+
+        _, _, log_len, deck_len, day = history[version - base]
+        if day != self.day:
+            return self.frontend_state()
+
+        changed_players = 0
+        changed_pyramids = 0
+        for players, pyramids, _, _, _ in history[version - base + 1:]:
+            changed_players |= players
+            changed_pyramids |= pyramids
+
+        logs = self.LogLines(log_len)
+        logs.reverse()
+
+        state = self.frontend_common()
+        state.update({
+            "full": False,
+            "players": [self.frontend_player(i) for i in range(self.game.n_players)
+                        if changed_players >> i & 1],
+            "pyramids": {type_strings[resource]: self.frontend_pyramid(resource)
+                         for resource in range(Type.Gold) if changed_pyramids >> resource & 1},
+            "deck_removed": deck_len - len(self.deck),
+            "logs": logs,
+        })
+        return state
     
+    def MultisetZobrist(self, keys, cards):
+        kind_index = self.game.card_kind_index
+        h = 0
+        copies = {}
+        for card in cards:
+            kind = kind_index[card]
+            n = copies.get(kind, 0)
+            h ^= keys[kind][n]
+            copies[kind] = n + 1
+        return h
+
+    def ComputeZobrist(self):
+        keys = self.game.zobrist
+        h = keys.day[self.day]
+        for player in range(self.game.n_players):
+            h ^= keys.money[player][self.money[player]]
+            h ^= self.MultisetZobrist(keys.ship[player], self.ships[player])
+        for player, bid in self.bids.items():
+            h ^= keys.bid[player][bid]
+        for resource in range(Type.Gold):
+            for player, count in enumerate(self.pyramids[resource]):
+                h ^= keys.pyramid[resource][player][count]
+        h ^= self.MultisetZobrist(keys.cards_in_play, self.cards_in_play)
+        h ^= self.MultisetZobrist(keys.deck, self.deck)
+        return h
+
+    def ZobristHash(self):
+        """Hash of the position, ignoring the hidden order of the deck."""
+        keys = self.game.zobrist
+        return (self.zobrist ^ keys.phase[self.phase]
+                ^ keys.current_player[self.current_player]
+                ^ keys.turn_player[self.turn_player])
+
+    def SetDeck(self, deck):
+        self.deck = deck
+        # copies of each card kind left in the deck, and their total value
+        self.deck_counts = [0] * len(self.game.card_kinds)
+        for card in deck:
+            self.deck_counts[self.game.card_kind_index[card]] += 1
+        self.deck_value = sum(card.value for card in deck)
+
+    def PopDeck(self):
+        card = self.deck.pop()
+        if self.journal is not None:
+            self.journal.append((kUndoPop, card))
+        kind = self.game.card_kind_index[card]
+        count = self.deck_counts[kind] - 1
+        self.deck_counts[kind] = count
+        self.deck_value -= card.value
+        self.zobrist ^= self.game.zobrist.deck[kind][count]
+        return card
+
+    def AddCardInPlay(self, card):
+        kind = self.game.card_kind_index[card]
+        self.zobrist ^= self.game.zobrist.cards_in_play[kind][self.cards_in_play.count(card)]
+        self.cards_in_play.append(card)
+        if self.journal is not None:
+            self.journal.append((kUndoInPlay,))
+
+    def AddToShip(self, player, card):
+        ship = self.ships[player]
+        kind = self.game.card_kind_index[card]
+        self.zobrist ^= self.game.zobrist.ship[player][kind][ship.count(card)]
+        ship.append(card)
+        self.ship_values[player] += card.value
+
     def DoApplyFrontendAction(self, action):
         self.DoApplyAction(self.from_frontend_action(action))
 
 
+    def CanDraw(self):
+        # can only draw if there is a card to draw
+        if len(self.deck) == 0:
+            return False
+
+        # can't make a lot that doesn't fit on a ship
+        room = self.ship_capacity - len(self.cards_in_play) - 1
+        for ship in self.ships:
+            if len(ship) <= room:
+                return True
+        return False
+
+    def BidRange(self):
+        """Returns (min_bid, max_bid, can_pass) for the current bidder.
+
+        The legal bids are min_bid..max_bid, which is empty when max_bid <
+        min_bid, plus passing (a bid of 0). Only valid in the bid phase.
+        """
+        # can't overfill a ship
+        if len(self.ships[self.current_player]) + len(self.cards_in_play) > self.ship_capacity:
+            return 1, 0, True
+        return self.high_bid + 1, self.money[self.current_player], True
+
     def LegalActions(self):
         if self.phase == Phase.Draw:
-            # can't make a lot that doesn't fit on a ship
-            can_draw = False
-            for ship in self.ships:
-                if len(ship) + len(self.cards_in_play) + 1 <= self.game.kShipCapacity:
-                    can_draw = True
-                    break
-
-            # can only draw if there is a card to draw
-            if len(self.deck) == 0:
-                can_draw = False
-
-            if can_draw:
+            if self.CanDraw():
                 return [DrawAction.Draw, DrawAction.Pass]
             else:
                 return [DrawAction.Pass]
         
         elif self.phase == Phase.Bid:
+            min_bid, max_bid, _ = self.BidRange()
+            if max_bid >= len(bid_actions):
+                bid_action(max_bid)
+            return bid_actions[min_bid:max_bid + 1] + [bid_actions[0]]
 
-            # can't overfill a ship
-            if len(self.ships[self.current_player]) + len(self.cards_in_play) > self.game.kShipCapacity:
-                return [BidAction(0)]
-            
-            max_bid = self.money[self.current_player]
-            if self.bids:
-                min_bid = max(self.bids.values()) + 1
-            else:
-                min_bid = 1
-            return [BidAction(i) for i in range(min_bid, max_bid + 1)] + [BidAction(0)]
+    def IsLegalAction(self, action):
+        """Whether `action` is in `LegalActions()`, without building it."""
+        if self.phase == Phase.Draw:
+            return isinstance(action, DrawAction) and (action == DrawAction.Pass or self.CanDraw())
+        elif self.phase == Phase.Bid:
+            if not isinstance(action, BidAction):
+                return False
+            min_bid, max_bid, can_pass = self.BidRange()
+            if action.value == 0:
+                return can_pass
+            return min_bid <= action.value <= max_bid
+        return False
+
+    def LegalActionsMask(self, out=None):
+        """Writes a 0/1 mask over the integer action ids into `out`, a
+        NumPy array of `game.num_distinct_actions` entries."""
+        if out is None:
+            import numpy as np
+            out = np.zeros(self.game.num_distinct_actions, dtype=np.int8)
+        else:
+            out[:] = 0
+
+        if self.phase == Phase.Draw:
+            out[kPassActionId] = 1
+            if self.CanDraw():
+                out[kDrawActionId] = 1
+        elif self.phase == Phase.Bid:
+            min_bid, max_bid, _ = self.BidRange()
+            out[kBidActionIdOffset] = 1
+            if max_bid >= min_bid:
+                out[kBidActionIdOffset + min_bid:kBidActionIdOffset + max_bid + 1] = 1
+        return out
+
+    def observation_tensor(self, player, out=None):
+        """Writes `player`'s view of the state into `out`, a NumPy array of
+        `game.observation_size` entries.
+
+        Players are listed starting from `player`. The layout is money,
+        bids (-1 before bidding), per-player ship card counts by
+        `game.card_kinds`, pyramid counts by resource, cards in play and the
+        remaining deck as card counts, then one-hot phase, day, current
+        player and turn player.
+        """
+        game = self.game
+        if out is None:
+            import numpy as np
+            out = np.zeros(game.observation_size, dtype=np.float32)
+        else:
+            out[:] = 0
+
+        p = game.n_players
+        n_kinds = len(game.card_kinds)
+        kind_index = game.card_kind_index
+        seats = [(player + i) % p for i in range(p)]
+
+        for i, seat in enumerate(seats):
+            out[i] = self.money[seat]
+            out[p + i] = self.bids.get(seat, -1)
+        offset = 2 * p
+
+        for i, seat in enumerate(seats):
+            for card in self.ships[seat]:
+                out[offset + i * n_kinds + kind_index[card]] += 1
+        offset += p * n_kinds
+
+        for resource in range(Type.Gold):
+            for i, seat in enumerate(seats):
+                out[offset + resource * p + i] = self.pyramids[resource][seat]
+        offset += Type.Gold * p
+
+        for card in self.cards_in_play:
+            out[offset + kind_index[card]] += 1
+        offset += n_kinds
+
+        out[offset:offset + n_kinds] = self.deck_counts
+        offset += n_kinds
+
+        out[offset + self.phase] = 1
+        offset += len(Phase)
+        out[offset + self.day] = 1
+        offset += game.n_days
+        out[offset + (self.current_player - player) % p] = 1
+        offset += p
+        out[offset + (self.turn_player - player) % p] = 1
+        return out
+
+    def SampleLegalAction(self, rng):
+        """A uniformly random legal action, without building the list.
+
+        Draws from `rng` exactly as picking from `LegalActions()` with
+        `random_index` would, including for a single legal action.
+        """
+        if self.phase == Phase.Draw:
+            if self.CanDraw():
+                return DrawAction(random_index(rng, 2))
+            random_index(rng, 1)
+            return DrawAction.Pass
+
+        elif self.phase == Phase.Bid:
+            min_bid, max_bid, _ = self.BidRange()
+            n_bids = max(max_bid - min_bid + 1, 0)
+            k = random_index(rng, n_bids + 1)
+            if k == n_bids:
+                return bid_actions[0]
+            return bid_action(min_bid + k)
     
     def NextPlayer(self, player):
         return (player + 1) % self.game.n_players
@@ -204,25 +746,40 @@ class MediciState:
     
         
     def DoApplyAction(self, action):
+        if self.journal is not None:
+            self.journal.append((
+                kUndoAction, self.turn_player, self.current_player, self.phase,
+                self.high_bid, self.zobrist, self.deck_value, self.n_full_ships,
+                self.day, self.is_game_over, self.winner, self.version, self.LogLength()))
+
         if action == DrawAction.Pass:
-            self.logs.append(f"Player {str(self.current_player)} passes.")
+            if self.log_mode:
+                self.Log(EventType.Pass, 1 << self.current_player)
             self.current_player = self.NextPlayer(self.current_player)
             self.phase = Phase.Bid
             
 
         elif action == DrawAction.Draw:
-            card = self.deck.pop()
-            self.cards_in_play.append(card)
-            self.logs.append(f"Player {str(self.current_player)} draws a {str(card)}.")
+            card = self.PopDeck()
+            self.AddCardInPlay(card)
+            if self.log_mode:
+                self.Log(EventType.Draw, 1 << self.current_player, self.game.card_kind_index[card])
             
-            if len(self.cards_in_play) == 3:
+            if len(self.cards_in_play) == self.max_lot_size:
                 self.current_player = self.NextPlayer(self.current_player)
                 self.phase = Phase.Bid
 
         elif isinstance(action, BidAction):
 
+            if self.journal is not None:
+                self.journal.append((kUndoBid, self.current_player, self.bids.get(self.current_player, -1)))
             self.bids[self.current_player] = action.value
-            self.logs.append(f"Player {str(self.current_player)} bids ${str(action.value)}.")
+            self.zobrist ^= self.game.zobrist.bid[self.current_player][action.value]
+            if action.value > self.high_bid:
+                self.high_bid = action.value
+            self.dirty_players |= 1 << self.current_player
+            if self.log_mode:
+                self.Log(EventType.Bid, 1 << self.current_player, action.value)
 
             if self.current_player == self.turn_player:
                 self.CompleteAuction()
@@ -232,28 +789,51 @@ class MediciState:
                 self.current_player = self.NextPlayer(self.current_player)
                 # while len(self.ships[self.current_player]) >= self.game.kShipCapacity:
                 #     self.current_player = self.NextPlayer(self.current_player)
+
+        self.version += 1
+        if self.frontend_history is not None:
+            self.frontend_history[1].append((self.dirty_players, self.dirty_pyramids,
+                                             self.LogLength(), len(self.deck), self.day))
+        self.dirty_players = 0
+        self.dirty_pyramids = 0
     
     def all_ships_but_one_full(self):
-        n_full_ships = 0
-        unfull_ship = -1
-        for i, ship in enumerate(self.ships):
-            if len(ship) >= self.game.kShipCapacity:
-                n_full_ships += 1
-            else:
-                unfull_ship = i
-        if n_full_ships == self.game.n_players - 1:
-            return True, unfull_ship
-        else:
-            return False, None
+        if self.n_full_ships == self.game.n_players - 1:
+            capacity = self.ship_capacity
+            for i, ship in enumerate(self.ships):
+                if len(ship) < capacity:
+                    return True, i
+        return False, None
+
+    def UpdatePyramidLeaders(self, resource):
+        top = 0
+        second = 0
+        for count in self.pyramids[resource]:
+            if count > top:
+                second = top
+                top = count
+            elif top > count > second:
+                second = count
+        self.pyramid_top[resource] = top
+        self.pyramid_second[resource] = second
         
     def CompleteShip(self, ship_idx):
-        print(f"COMPLETING SHIP {ship_idx}")
+        self.dirty_players |= 1 << ship_idx
         ship = self.ships[ship_idx]
-        while len(ship) <= self.game.kShipCapacity:
+        capacity = self.ship_capacity
+        was_full = len(ship) >= capacity
+        n_cards = len(ship)
+        while len(ship) <= capacity:
             if self.deck:
-                ship.append(self.deck.pop())
+                self.AddToShip(ship_idx, self.PopDeck())
             else:
                 break
+        if self.journal is not None:
+            self.journal.append((kUndoFill, ship_idx, len(ship) - n_cards))
+        if self.log_mode:
+            self.Log(EventType.CompleteShip, 1 << ship_idx, len(ship) - n_cards)
+        if not was_full and len(ship) >= capacity:
+            self.n_full_ships += 1
 
         
             
@@ -261,18 +841,38 @@ class MediciState:
         max_bid = 0
         winner = -1
         for player, bid in self.bids.items():
+            self.dirty_players |= 1 << player
             if bid > max_bid:
                 winning_bid = bid
                 winner = player
 
+        game = self.game
+        keys = game.zobrist
+        capacity = self.ship_capacity
         if winner != -1:
+            if self.journal is not None:
+                self.journal.append((kUndoWin, winner, winning_bid,
+                                     tuple(self.pyramid_top), tuple(self.pyramid_second)))
+            self.zobrist ^= keys.money[winner][self.money[winner]]
             self.money[winner] -= winning_bid
-            self.ships[winner] += self.cards_in_play
+            self.zobrist ^= keys.money[winner][self.money[winner]]
+            ship = self.ships[winner]
+            was_full = len(ship) >= capacity
 
-            # update purchase counts
+            # update ship, ship value and purchase counts
             for card in self.cards_in_play:
+                self.AddToShip(winner, card)
                 if card.type != Type.Gold:
-                    self.pyramids[card.type][winner] += 1
+                    count = self.pyramids[card.type][winner]
+                    self.pyramids[card.type][winner] = count + 1
+                    self.zobrist ^= (keys.pyramid[card.type][winner][count]
+                                     ^ keys.pyramid[card.type][winner][count + 1])
+                    self.dirty_pyramids |= 1 << card.type
+            if not was_full and len(ship) >= capacity:
+                self.n_full_ships += 1
+            for resource in range(Type.Gold):
+                if self.dirty_pyramids >> resource & 1:
+                    self.UpdatePyramidLeaders(resource)
             
 
         # check if day is over
@@ -283,152 +883,113 @@ class MediciState:
         elif len(self.deck) == 0:
             self.CompleteDay()
         else:
-            self.cards_in_play = [self.deck.pop()]
+            self.zobrist ^= self.MultisetZobrist(keys.cards_in_play, self.cards_in_play)
+            for player, bid in self.bids.items():
+                self.zobrist ^= keys.bid[player][bid]
+            if self.journal is not None:
+                self.journal.append((kUndoLot, self.cards_in_play, self.bids))
+            self.cards_in_play = []
+            self.AddCardInPlay(self.PopDeck())
             self.bids = {}
+            self.high_bid = 0
             self.phase = Phase.Draw
 
             # first player to bid is the next player who has capacity
             self.turn_player = self.NextPlayer(self.turn_player)
-            while len(self.ships[self.turn_player]) >= self.game.kShipCapacity:
+            while len(self.ships[self.turn_player]) >= capacity:
                 self.turn_player = self.NextPlayer(self.turn_player)
             self.current_player = self.turn_player
 
 
     def DoShipValueScoring(self):
-        ship_values = [0, 0, 0, 0]
-        for player, ship in enumerate(self.ships):
-            ship_values[player] = sum([card.value for card in ship])
-        
-        # work out winning ship values
-        ship_values_unique = sorted(list(set(ship_values)), reverse=True)
-        first_value = ship_values_unique[0]
-        if len(ship_values_unique) > 1:
-            second_value = ship_values_unique[1]
-        if len(ship_values_unique) > 2:
-            third_value = ship_values_unique[2]
-        
+        ship_values = self.ship_values
+
+        # work out the three highest distinct ship values (-1 if missing)
+        first_value = second_value = third_value = -1
+        for value in ship_values:
+            if value > first_value:
+                first_value, second_value, third_value = value, first_value, second_value
+            elif first_value > value > second_value:
+                second_value, third_value = value, second_value
+            elif second_value > value > third_value:
+                third_value = value
+
         # work out tiering of players by ship value
-        first_players = []
-        second_players = []
-        third_players = []
+        tiers = ([], [], [])
         for player, value in enumerate(ship_values):
             if value == first_value:
-                first_players.append(player)
-        if len(first_players) < 3:
-            for player, value in enumerate(ship_values):
-                if value == second_value:
-                    second_players.append(player)
-        if len(first_players) + len(second_players) < 3:
-            for player, value in enumerate(ship_values):
-                if value == third_value:
-                    third_players.append(player)
-
-        # determine points for ship values
-        if len(first_players) == 1:
-            top_ship_value_reward = self.game.kShipValueRewards[0]
-            self.money[first_players[0]] += top_ship_value_reward
-            self.logs.append(f"Player {str(first_players[0])} gets ${top_ship_value_reward} for having the highest ship value ({first_value}).")
-
-            if len(second_players) == 1:
-                second_ship_value_reward = self.game.kShipValueRewards[1]
-                self.money[second_players[0]] += second_ship_value_reward
-                self.logs.append(f"Player {str(second_players[0])} gets ${second_ship_value_reward} for having the second highest ship value ({second_value}).")
-                
-                third_ship_value_reward = self.game.kShipValueRewards[2] // len(third_players)
-                for player in third_players:
-                    self.money[player] += third_ship_value_reward
-                if len(third_players) == 1:
-                    self.logs.append(f"Player {third_players[0]} gets ${third_ship_value_reward} for having the third highest ship value ({third_value}).")
-                else:
-                    self.logs.append(f"Players {str(third_players)} get ${third_ship_value_reward} for having the third highest ship value ({third_value}).")
-            else:
-                second_ship_value_reward = (self.game.kShipValueRewards[1] + self.game.kShipValueRewards[2]) // len(second_players)
-                for player in second_players:
-                    self.money[player] += second_ship_value_reward
-                if len(second_players) == 2:
-                    self.logs.append(f"Players {str(second_players[0])} and {str(second_players[1])} get ${second_ship_value_reward} for having the second highest ship value.")
-                else:
-                    self.logs.append(f"Players {str(second_players)} get ${second_ship_value_reward} for having the second highest ship value.")
- 
-        elif len(first_players) == 2:
-            top_ship_value_reward = (self.game.kShipValueRewards[0] + self.game.kShipValueRewards[1]) // len(first_players)
-            self.money[first_players[0]] += top_ship_value_reward
-            self.money[first_players[1]] += top_ship_value_reward
-            self.logs.append(f"Players {str(first_players[0])} and {str(first_players[1])} get ${top_ship_value_reward} for having the third highest ship value.")
-
-            second_ship_value_reward = self.game.kShipValueRewards[2] // len(second_players)
-            for player in second_players:
-                self.money[player] += second_ship_value_reward
-            if len(second_players) == 1:
-                self.logs.append(f"Player {second_players[0]} gets ${second_ship_value_reward} for having the second highest ship value.")
-            else:
-                self.logs.append(f"Players {str(second_players)} get ${second_ship_value_reward} for having the second highest ship value.")
-            
-
-        elif len(first_players) >= 3:
-            top_ship_value_reward = (self.game.kShipValueRewards[0] + self.game.kShipValueRewards[1] + self.game.kShipValueRewards[2]) // len(first_players)
-            for player in first_players:
-                self.money[player] += top_ship_value_reward
-            self.logs.append(f"Players {str(first_players)} get ${top_ship_value_reward} for having the highest ship value.")
+                tiers[0].append(player)
+            elif value == second_value:
+                tiers[1].append(player)
+            elif value == third_value:
+                tiers[2].append(player)
+
+        money = self.money
+        payouts = self.game.ship_value_payout_table[len(tiers[0]), len(tiers[1]), len(tiers[2])]
+        for tier, (payout, event_type) in zip(tiers, payouts):
+            if payout and tier:
+                for player in tier:
+                    money[player] += payout
+                if self.log_mode:
+                    self.Log(event_type, players_mask(tier), payout, ship_values[tier[0]])
 
     def DoPyramidScoring(self):
+        money = self.money
+        bonuses = self.game.pyramid_bonus_by_count
         # determine points for pyramids
         for type in [Type.Cloth, Type.Fur, Type.Grain, Type.Dye, Type.Spice]:
             
             pyramid = self.pyramids[type]
-            # print(f"type: {type}")
-            # print(f"pyramid: {pyramid}")
-            top_pyramid_value = max(pyramid)
-            try:
-                second_pyramid_value = max([value for value in pyramid if value != top_pyramid_value])
-            except:
-                second_pyramid_value = 0
-            # print(f"top: {top_pyramid_value}")
-            # print(f"second: {second_pyramid_value}")
-
-            top_purchasers = [player for player in range(self.game.n_players) if pyramid[player] == top_pyramid_value]
-            second_purchasers = [player for player in range(self.game.n_players) if pyramid[player] == second_pyramid_value]
-
-            if len(top_purchasers) == 1:
-                pyramid_reward_top = self.game.kPyramidRewards[0]
-                self.money[top_purchasers[0]] += pyramid_reward_top
-                self.logs.append(f"Player {top_purchasers[0]} gets ${pyramid_reward_top} for having the most {type_strings[int(type)]}.")
-
-                pyramid_reward_second = self.game.kPyramidRewards[1] // len(second_purchasers)
+            top_pyramid_value = self.pyramid_top[type]
+            second_pyramid_value = self.pyramid_second[type]
+
+            top_purchasers = []
+            second_purchasers = []
+            for player, value in enumerate(pyramid):
+                if value == top_pyramid_value:
+                    top_purchasers.append(player)
+                elif value == second_pyramid_value:
+                    second_purchasers.append(player)
+
+            (top_payout, top_event), (second_payout, second_event) = \
+                self.game.pyramid_payout_table[len(top_purchasers), len(second_purchasers)]
+            for player in top_purchasers:
+                money[player] += top_payout
+            if self.log_mode:
+                self.Log(top_event, players_mask(top_purchasers), top_payout, type)
+            if second_payout and second_purchasers:
                 for player in second_purchasers:
-                    self.money[player] += pyramid_reward_second
-                self.logs.append(f"Player(s) {second_purchasers} get(s) ${pyramid_reward_second} for having the second most {type_strings[int(type)]}.")
-
-            else:
-                pyramid_reward_top = (self.game.kPyramidRewards[0] + self.game.kPyramidRewards[1]) // len(top_purchasers)
-                for player in top_purchasers:
-                    self.money[player] += pyramid_reward_top
-                self.logs.append(f"Player(s) {top_purchasers} get(s) ${pyramid_reward_top} for purchasing the most {type_strings[int(type)]}.")
-
+                    money[player] += second_payout
+                if self.log_mode:
+                    self.Log(second_event, players_mask(second_purchasers), second_payout, type)
 
             # determine bonus points for pyramid
-            for player in range(self.game.n_players):
-                if pyramid[player] == 5:
-                    self.money[player] += self.game.kPyramidBonusFive
-                    self.logs.append(f"Player {player} gets ${self.game.kPyramidBonusFive} for purchasing 5 {type_strings[int(type)]}.")
-                if pyramid[player] == 6:
-                    self.money[player] += self.game.kPyramidBonusSix
-                    self.logs.append(f"Player {player} gets ${self.game.kPyramidBonusSix} for purchasing 6 {type_strings[int(type)]}.")
-                if pyramid[player] >= 7:
-                    self.money[player] += self.game.kPyramidBonusSeven
-                    self.logs.append(f"Player {player} gets ${self.game.kPyramidBonusSeven} for purchasing 7 {type_strings[int(type)]}.")
+            for player, count in enumerate(pyramid):
+                bonus = bonuses[count]
+                if bonus:
+                    money[player] += bonus
+                    if self.log_mode:
+                        self.Log(EventType.PyramidBonus, 1 << player, bonus, type,
+                                 self.game.pyramid_bonus_table[count][1])
     
     def DoScoring(self):        
         self.DoShipValueScoring()
         self.DoPyramidScoring()
 
     def CompleteDay(self):
+        if self.journal is not None:
+            # everything below replaces these or, for money, changes it in place
+            self.journal.append((kUndoDay, self.money.copy(), self.ships, self.ship_values,
+                                 self.deck, self.deck_counts, self.cards_in_play, self.bids))
 
         self.DoScoring()
 
         self.ships = [[] for _ in range(self.game.n_players)]
+        self.ship_values = [0] * self.game.n_players
+        self.n_full_ships = 0
+        self.dirty_players |= (1 << self.game.n_players) - 1
 
-        if self.day == 2:
+        if self.day == self.game.n_days - 1:
             self.phase = Phase.GameOver
             self.is_game_over = True
             highest_money = max(self.money)
@@ -436,11 +997,11 @@ class MediciState:
         else: # next day
             self.day += 1
 
-            self.deck = self.game.all_cards.copy()
-            shuffle(self.deck)
+            self.SetDeck(self.game.ShuffledDeck(self.rng))
 
-            self.cards_in_play = [self.deck.pop()]
+            self.cards_in_play = [self.PopDeck()]
             self.bids = {}
+            self.high_bid = 0
             self.phase = Phase.Draw
 
             # determine start player for new day
@@ -449,6 +1010,85 @@ class MediciState:
             self.turn_player = start_player
             self.current_player = start_player
 
+        # a new day replaces most of the state, so rehash it all
+        self.zobrist = self.ComputeZobrist()
+
+    def StartJournal(self):
+        """Records changes from now on, so actions can be taken back with
+        UndoAction. Clones do not inherit the journal."""
+        if self.journal is None:
+            self.journal = []
+
+    def StopJournal(self):
+        self.journal = None
+
+    def CanUndo(self):
+        return bool(self.journal)
+
+    def UndoAction(self):
+        """Takes back the last action applied since StartJournal, restoring
+        the state exactly, day-end resets included. The rng is not rewound,
+        so a day dealt again after undoing its start gets a new deck."""
+        journal = self.journal
+        if not journal:
+            raise ValueError("no action to undo")
+        while True:
+            entry = journal.pop()
+            op = entry[0]
+            if op == kUndoAction:
+                (_, self.turn_player, self.current_player, self.phase, self.high_bid,
+                 self.zobrist, self.deck_value, self.n_full_ships, self.day,
+                 self.is_game_over, self.winner, self.version, log_length) = entry
+                break
+            elif op == kUndoPop:
+                card = entry[1]
+                self.deck.append(card)
+                self.deck_counts[self.game.card_kind_index[card]] += 1
+            elif op == kUndoInPlay:
+                self.cards_in_play.pop()
+            elif op == kUndoBid:
+                _, player, bid = entry
+                if bid == -1:
+                    del self.bids[player]
+                else:
+                    self.bids[player] = bid
+            elif op == kUndoWin:
+                _, winner, winning_bid, pyramid_top, pyramid_second = entry
+                self.money[winner] += winning_bid
+                ship = self.ships[winner]
+                del ship[len(ship) - len(self.cards_in_play):]
+                for card in self.cards_in_play:
+                    self.ship_values[winner] -= card.value
+                    if card.type != Type.Gold:
+                        self.pyramids[card.type][winner] -= 1
+                self.pyramid_top[:] = pyramid_top
+                self.pyramid_second[:] = pyramid_second
+            elif op == kUndoFill:
+                _, ship_idx, n_cards = entry
+                ship = self.ships[ship_idx]
+                for _ in range(n_cards):
+                    self.ship_values[ship_idx] -= ship.pop().value
+            elif op == kUndoLot:
+                _, self.cards_in_play, self.bids = entry
+            else:
+                (_, self.money, self.ships, self.ship_values, self.deck, self.deck_counts,
+                 self.cards_in_play, self.bids) = entry
+
+        if self.events is None:
+            del self.logs[log_length:]
+        else:
+            self.n_events = log_length
+        self.dirty_players = 0
+        self.dirty_pyramids = 0
+        # frontend snapshots and diffs only ever move forward
+        self.frontend_cache = None
+        if self.frontend_history is not None:
+            base, history = self.frontend_history
+            if self.version < base:
+                self.frontend_history = None
+            else:
+                del history[self.version - base + 1:]
+
     def IsTerminal(self):
         return self.phase == Phase.GameOver
 
@@ -468,51 +1108,417 @@ class MediciState:
 
         return s
 
-class MediciGame:
-    all_cards = [
-        Card(type, i) 
-        for type in [Type.Cloth, Type.Fur, Type.Grain, Type.Dye, Type.Spice]
-        for i in [0, 1, 2, 3, 4, 5, 5] 
-    ] + [Card(Type.Gold, 10)]
+class DeckBelief:
+    """What `player` knows about the hidden deck of `state`: the copies of
+    each card kind left, but not their order.
+
+    Every card leaves the deck face up, whether drawn into a lot or dealt
+    to a ship by CompleteShip, so this is the same for every player and
+    reads the state's `deck_counts` and `deck_value`, which PopDeck keeps
+    up to date. Nothing here looks at the deck itself.
+    """
+
+    __slots__ = ("state", "player")
+
+    def __init__(self, state, player):
+        self.state = state
+        self.player = player
+
+    def Counts(self):
+        # indexed like game.card_kinds; must not be modified
+        return self.state.deck_counts
+
+    def Size(self):
+        return len(self.state.deck)
+
+    def Probability(self, card):
+        """Chance that the next card popped is `card`."""
+        size = len(self.state.deck)
+        if size == 0:
+            return 0.0
+        return self.state.deck_counts[self.state.game.card_kind_index[card]] / size
+
+    def ExpectedNextValue(self):
+        size = len(self.state.deck)
+        if size == 0:
+            return 0.0
+        return self.state.deck_value / size
+
+    def SampleDeck(self, rng=None):
+        """A deck drawn uniformly from the orders consistent with the
+        counts."""
+        deck = []
+        for card, count in zip(self.state.game.card_kinds, self.state.deck_counts):
+            if count:
+                deck += [card] * count
+        (rng or random).shuffle(deck)
+        return deck
+
+
+class Histogram:
+    """Durations in power-of-two nanosecond buckets."""
 
     def __init__(self):
-        self.n_players = 4
+        self.buckets = [0] * 64 # bucket i holds durations below 2**i ns
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def Add(self, ns):
+        self.buckets[ns.bit_length()] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    def Percentile(self, q):
+        # upper bound of the bucket holding the q-th fraction of durations
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return 1 << i
+        return 0
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ns": self.total_ns,
+            "mean_ns": self.total_ns / self.count if self.count else 0.0,
+            "max_ns": self.max_ns,
+            "p50_ns": self.Percentile(0.5),
+            "p99_ns": self.Percentile(0.99),
+            "buckets": {1 << i: n for i, n in enumerate(self.buckets) if n},
+        }
 
-        self.kShipCapacity = 5
-        self.kHighestPoints = 10
-        self.kSecondHighestPoints = 5
+class Instrumentation:
+    """Counters and timing histograms shared by every state of a game.
 
-        self.kFiveBonus = 5
-        self.kSixBonus = 10
-        self.kSevenBonus = 20
+    Set on a `MediciGame` to make it create `InstrumentedMediciState`s.
+    Updates are not locked, so counts from states used on several threads
+    at once are approximate.
+    """
 
-        # ship value rewards
-        self.kShipValueRewards = [30, 20, 10]
+    timed_methods = ["LegalActions", "DoApplyAction", "DoScoring", "frontend_state"]
 
-        # pyramid rewards
-        self.kPyramidRewards = [10, 5]
-        
-        # pyramid bonus
-        self.kPyramidBonusFive = 5
-        self.kPyramidBonusSix = 10
-        self.kPyramidBonusSeven = 20
+    def __init__(self):
+        self.Reset()
+
+    def Reset(self):
+        self.actions_per_phase = [0] * len(Phase)
+        self.auctions = 0
+        self.days = 0
+        self.ship_fills = 0
+        self.timings = {name: Histogram() for name in self.timed_methods}
+
+    def snapshot(self):
+        return {
+            "actions_per_phase": {phase_strings[phase]: n for phase, n in enumerate(self.actions_per_phase)},
+            "auctions": self.auctions,
+            "days": self.days,
+            "ship_fills": self.ship_fills,
+            "timings": {name: histogram.snapshot() for name, histogram in self.timings.items()},
+        }
 
-        self.n_pyramid_levels = 8
+class InstrumentedMediciState(MediciState):
+    # MediciState feeding its game's Instrumentation; plain states pay
+    # nothing for it
+    __slots__ = ()
 
+    def Clone(self, log_mode=LogMode.Off):
+        # clones belong to searches, whose work would swamp the counters
+        state = super().Clone(log_mode)
+        state.__class__ = MediciState
+        return state
+
+    def LegalActions(self):
+        start = time.perf_counter_ns()
+        legal_actions = super().LegalActions()
+        self.game.instrumentation.timings["LegalActions"].Add(time.perf_counter_ns() - start)
+        return legal_actions
+
+    def DoApplyAction(self, action):
+        instrumentation = self.game.instrumentation
+        instrumentation.actions_per_phase[self.phase] += 1
+        start = time.perf_counter_ns()
+        super().DoApplyAction(action)
+        instrumentation.timings["DoApplyAction"].Add(time.perf_counter_ns() - start)
+
+    def CompleteAuction(self):
+        self.game.instrumentation.auctions += 1
+        super().CompleteAuction()
+
+    def CompleteShip(self, ship_idx):
+        self.game.instrumentation.ship_fills += 1
+        super().CompleteShip(ship_idx)
+
+    def DoScoring(self):
+        start = time.perf_counter_ns()
+        super().DoScoring()
+        self.game.instrumentation.timings["DoScoring"].Add(time.perf_counter_ns() - start)
+
+    def CompleteDay(self):
+        self.game.instrumentation.days += 1
+        super().CompleteDay()
+
+    def frontend_state(self):
+        start = time.perf_counter_ns()
+        state = super().frontend_state()
+        self.game.instrumentation.timings["frontend_state"].Add(time.perf_counter_ns() - start)
+        return state
+
+@dataclass(frozen=True)
+class MediciRules:
+    """The rules of a Medici variant, checked when created.
+
+    Everything derived from the rules (the deck, payout tables, action and
+    observation sizes, Zobrist keys) is computed on first use and kept on
+    the rules object, so games built from the same rules share it.
+    """
+
+    n_players: int = 4
+    ship_capacity: int = 5
+    max_lot_size: int = 3
+    n_days: int = 3
+    starting_money: int = 40
+    resource_values: Tuple[int, ...] = (0, 1, 2, 3, 4, 5, 5) # the cards of each resource
+    gold_values: Tuple[int, ...] = (10,)
+    ship_value_rewards: Tuple[int, int, int] = (30, 20, 10)
+    pyramid_rewards: Tuple[int, int] = (10, 5)
+    pyramid_bonuses: Tuple[int, int, int] = (5, 10, 20) # for 5, 6 and 7 or more purchases
+    n_pyramid_levels: int = 8 # purchase counts the frontend shows
+
+    def __post_init__(self):
+        if not 2 <= self.n_players <= 6:
+            raise ValueError(f"n_players must be between 2 and 6, got {self.n_players}")
+        if self.ship_capacity < 1:
+            raise ValueError(f"ship_capacity must be positive, got {self.ship_capacity}")
+        if not 1 <= self.max_lot_size <= self.ship_capacity:
+            raise ValueError(f"max_lot_size must be between 1 and ship_capacity, got {self.max_lot_size}")
+        if self.n_days < 1:
+            raise ValueError(f"n_days must be positive, got {self.n_days}")
+        if not self.resource_values:
+            raise ValueError("resource_values must not be empty")
+        for name, length in [("ship_value_rewards", 3), ("pyramid_rewards", 2), ("pyramid_bonuses", 3)]:
+            values = getattr(self, name)
+            if len(values) != length:
+                raise ValueError(f"{name} must have {length} entries, got {len(values)}")
+        for name in ["starting_money", "resource_values", "gold_values", "ship_value_rewards",
+                     "pyramid_rewards", "pyramid_bonuses"]:
+            values = getattr(self, name)
+            if min(values if isinstance(values, tuple) else [values], default=0) < 0:
+                raise ValueError(f"{name} must not be negative")
+
+    @cached_property
+    def all_cards(self):
+        return [
+            Card(type, value)
+            for type in [Type.Cloth, Type.Fur, Type.Grain, Type.Dye, Type.Spice]
+            for value in self.resource_values
+        ] + [Card(Type.Gold, value) for value in self.gold_values]
+
+    @cached_property
+    def card_kinds(self):
+        # distinct cards, for count-based encodings
+        return sorted(set(self.all_cards))
+
+    @cached_property
+    def card_kind_index(self):
+        return {card: i for i, card in enumerate(self.card_kinds)}
+
+    @cached_property
+    def max_purchases(self):
+        # most cards of one resource a player can buy over the game
+        return self.n_days * len(self.resource_values)
+
+    @cached_property
+    def ship_value_payout_table(self):
+        # day-end payouts by the sizes of the top three ship value tiers
+        p = self.n_players
+        return {
+            (n_first, n_second, n_third): self.ShipValueTierPayouts(n_first, n_second, n_third)
+            for n_first in range(1, p + 1)
+            for n_second in range(p - n_first + 1)
+            for n_third in range(p - n_first - n_second + 1)
+        }
+
+    @cached_property
+    def pyramid_payout_table(self):
+        # day-end payouts by the sizes of the top two purchase count tiers
+        p = self.n_players
+        return {
+            (n_top, n_second): self.PyramidTierPayouts(n_top, n_second)
+            for n_top in range(1, p + 1)
+            for n_second in range(p - n_top + 1)
+        }
+
+    @cached_property
+    def pyramid_bonus_table(self):
+        return [self.PyramidBonus(count) for count in range(self.max_purchases + 1)]
+
+    @cached_property
+    def pyramid_bonus_by_count(self):
+        # unlike pyramid_bonuses, one entry per purchase count
+        return [bonus for bonus, _ in self.pyramid_bonus_table]
+
+    @cached_property
+    def best_day_payout(self):
+        best_ship = max(payout for payouts in self.ship_value_payout_table.values()
+                        for payout, _ in payouts)
+        best_pyramid = max(payout for payouts in self.pyramid_payout_table.values()
+                           for payout, _ in payouts)
+        return best_ship + Type.Gold * (best_pyramid + max(self.pyramid_bonuses))
+
+    @cached_property
+    def max_bid(self):
+        # Money only grows through day-end scoring, so nobody can bid more
+        # than the starting money plus the best possible payout for every
+        # day but the last.
+        return self.starting_money + (self.n_days - 1) * self.best_day_payout
+
+    @cached_property
+    def max_money(self):
+        return self.starting_money + self.n_days * self.best_day_payout
+
+    @cached_property
+    def num_distinct_actions(self):
+        return kBidActionIdOffset + self.max_bid + 1
+
+    @cached_property
+    def observation_size(self):
+        p = self.n_players
+        n_kinds = len(self.card_kinds)
+        # money, bids, ships, pyramids, cards in play, deck, phase, day,
+        # current player, turn player
+        return (2 * p + p * n_kinds + Type.Gold * p + 2 * n_kinds
+                + len(Phase) + self.n_days + 2 * p)
+
+    @cached_property
+    def zobrist(self):
+        return ZobristKeys(self)
+
+    def ShipValueTierPayouts(self, n_first, n_second, n_third):
+        """(payout per player, event) for each of the top three ship value
+        tiers, given how many players are in each."""
+        rewards = self.ship_value_rewards
+        if n_first == 1:
+            if n_second == 1:
+                return [(rewards[0], EventType.ShipValueFirst),
+                        (rewards[1], EventType.ShipValueSecond),
+                        (rewards[2] // max(n_third, 1), EventType.ShipValueThird)]
+            return [(rewards[0], EventType.ShipValueFirst),
+                    ((rewards[1] + rewards[2]) // max(n_second, 1), EventType.ShipValueTiedSecond),
+                    (0, None)]
+        elif n_first == 2:
+            return [((rewards[0] + rewards[1]) // 2, EventType.ShipValueTiedFirst),
+                    (rewards[2] // max(n_second, 1), EventType.ShipValueSecondAfterTie),
+                    (0, None)]
+        return [(sum(rewards) // n_first, EventType.ShipValueTiedAll), (0, None), (0, None)]
+
+    def PyramidTierPayouts(self, n_top, n_second):
+        """(payout per player, event) for the top two purchase counts of a
+        resource, given how many players have each."""
+        rewards = self.pyramid_rewards
+        if n_top == 1:
+            return [(rewards[0], EventType.PyramidFirst),
+                    (rewards[1] // max(n_second, 1), EventType.PyramidSecond)]
+        return [((rewards[0] + rewards[1]) // n_top, EventType.PyramidTiedFirst), (0, None)]
+
+    def PyramidBonus(self, count):
+        # (bonus, purchases shown in the log) for buying `count` of a resource
+        five, six, seven = self.pyramid_bonuses
+        if count >= 7:
+            return seven, 7
+        elif count == 6:
+            return six, 6
+        elif count == 5:
+            return five, 5
+        return 0, count
+
+default_rules = MediciRules()
+
+class MediciGame:
+    def __init__(self, rules=None, log_mode=LogMode.Text, instrumentation=None):
+        if rules is None:
+            rules = default_rules
+        self.rules = rules
+        self.log_mode = log_mode
+        self.instrumentation = instrumentation
+
+        # the rules, under the names the engine uses
+        self.n_players = rules.n_players
+        self.kShipCapacity = rules.ship_capacity
+        self.kMaxLotSize = rules.max_lot_size
+        self.n_pyramid_levels = rules.n_pyramid_levels
+
+        self.n_days = rules.n_days
+        self.kStartingMoney = rules.starting_money
+
+        # derived once per rules object
+        self.all_cards = rules.all_cards
+        self.card_kinds = rules.card_kinds
+        self.card_kind_index = rules.card_kind_index
+        self.kMaxBid = rules.max_bid
+        self.kMaxMoney = rules.max_money
+        self.num_distinct_actions = rules.num_distinct_actions
+        self.max_purchases = rules.max_purchases
+        self.ship_value_payout_table = rules.ship_value_payout_table
+        self.pyramid_payout_table = rules.pyramid_payout_table
+        self.pyramid_bonus_table = rules.pyramid_bonus_table
+        self.pyramid_bonus_by_count = rules.pyramid_bonus_by_count
+        self.observation_size = rules.observation_size
+        self.zobrist = rules.zobrist
+
+    def ScoreDay(self, ship_values, pyramids):
+        """Day-end payout per player for the given ship values and pyramid
+        counts (indexed by resource, then player), without a state."""
+        payouts = [0] * self.n_players
+        tiers = value_tiers(ship_values, 3)
+        for tier, (payout, _) in zip(tiers, self.ship_value_payout_table[tuple(map(len, tiers))]):
+            for player in tier:
+                payouts[player] += payout
+        for pyramid in pyramids:
+            tiers = value_tiers(pyramid, 2)
+            for tier, (payout, _) in zip(tiers, self.pyramid_payout_table[tuple(map(len, tiers))]):
+                for player in tier:
+                    payouts[player] += payout
+            for player, count in enumerate(pyramid):
+                payouts[player] += self.pyramid_bonus_table[count][0]
+        return payouts
+
+    def ShuffledDeck(self, rng):
+        if rng is None:
+            rng = random
+        permutation = getattr(rng, "permutation", None)
+        if permutation is not None:
+            # NumPy generators draw the whole permutation in one call
+            return [self.all_cards[i] for i in permutation(len(self.all_cards))]
+        deck = self.all_cards.copy()
+        rng.shuffle(deck)
+        return deck
     
-    def InitialState(self):
-        return MediciState(self)
+    def InitialState(self, rng=None):
+        if self.instrumentation is not None:
+            return InstrumentedMediciState(self, rng)
+        return MediciState(self, rng)
     
 class RandomBot:
+    def __init__(self, rng=None):
+        self.rng = rng
+
     def ChooseAction(self, state):
-        return choice(state.LegalActions())
+        return state.SampleLegalAction(self.rng)
+
+    def InformAction(self, state, action):
+        pass
 
 if __name__ == "__main__":
     game = MediciGame()
     state = game.InitialState()
 
     for i in range(80):
-        action = choice(state.LegalActions())
+        action = random.choice(state.LegalActions())
         print(f"Action: {action}")
         state.DoApplyAction(action)
         print("State:")
@@ -0,0 +1,353 @@
+import functools
+import random
+
+import numpy as np
+
+import medici
+from medici import Phase, DrawAction, Type, kDrawActionId, kPassActionId, kBidActionIdOffset
+
+
+@functools.lru_cache(maxsize=16)
+def scoring_tables(rules):
+    """The day-end payout tables of `rules` as arrays: ship value payouts
+    by (n_first, n_second, n_third, tier), pyramid payouts by (n_top,
+    n_second, tier) and pyramid bonuses by purchase count. The last tier
+    pays nothing."""
+    p = rules.n_players
+    ship = np.zeros((p + 1, p + 1, p + 1, 4), dtype=np.int64)
+    for pattern, payouts in rules.ship_value_payout_table.items():
+        ship[pattern][:3] = [payout for payout, _ in payouts]
+    pyramid = np.zeros((p + 1, p + 1, 3), dtype=np.int64)
+    for pattern, payouts in rules.pyramid_payout_table.items():
+        pyramid[pattern][:2] = [payout for payout, _ in payouts]
+    bonus = np.array(rules.pyramid_bonus_by_count, dtype=np.int64)
+    return ship, pyramid, bonus
+
+
+def tier_indices(values, n_tiers):
+    """For non-negative `values`, the tier of each entry among the `n_tiers`
+    highest distinct values along the last axis (`n_tiers` below them), and
+    the number of entries in each tier."""
+    tier = np.full(values.shape, n_tiers)
+    remaining = values
+    sizes = []
+    for t in range(n_tiers):
+        top = remaining.max(axis=-1, keepdims=True)
+        in_tier = values == top
+        tier[in_tier] = t
+        sizes.append(in_tier.sum(axis=-1))
+        remaining = np.where(in_tier, -1, remaining)
+    return tier, sizes
+
+
+def score_day(game, ship_values, pyramids):
+    """Day-end payouts, (n_games, n_players), for (n_games, n_players) ship
+    values and (n_games, n_resources, n_players) purchase counts."""
+    ship_table, pyramid_table, bonus_table = scoring_tables(game.rules)
+
+    tier, (n_first, n_second, n_third) = tier_indices(ship_values, 3)
+    payouts = ship_table[n_first[:, None], n_second[:, None], n_third[:, None], tier]
+
+    tier, (n_top, n_second) = tier_indices(pyramids, 2)
+    pyramid_payouts = pyramid_table[n_top[..., None], n_second[..., None], tier]
+    pyramid_payouts += bonus_table[np.minimum(pyramids, len(bonus_table) - 1)]
+    return payouts + pyramid_payouts.sum(axis=1)
+
+
+class BatchMediciEnv:
+    """Steps many Medici games in lockstep.
+
+    Cards are stored as indices into `game.all_cards`. In the draw phase an
+    action is a `DrawAction` value; in the bid phase it is the bid (0 passes).
+    Decks are shuffled with `random.Random(seed)` per game, so game `i`
+    deals the same cards as `game.InitialState(random.Random(seeds[i]))`.
+    """
+
+    def __init__(self, game, seeds):
+        self.game = game
+        self.n_games = len(seeds)
+        self.n_players = game.n_players
+        self.n_days = game.n_days
+        self.capacity = game.kShipCapacity
+        self.lot_size = game.kMaxLotSize
+
+        self.card_types = np.array([int(card.type) for card in game.all_cards], dtype=np.int64)
+        self.card_values = np.array([card.value for card in game.all_cards], dtype=np.int64)
+        self.n_cards = len(game.all_cards)
+        self.n_kinds = len(game.card_kinds)
+        self.card_kinds = np.array([game.card_kind_index[card] for card in game.all_cards])
+
+        self.reset(seeds)
+
+    def reset(self, seeds):
+        n, p = self.n_games, self.n_players
+        self.games = np.arange(n)
+
+        self.decks = np.empty((n, self.n_days, self.n_cards), dtype=np.int64)
+        for i, seed in enumerate(seeds):
+            rng = random.Random(seed)
+            for day in range(self.n_days):
+                order = list(range(self.n_cards))
+                rng.shuffle(order)
+                self.decks[i, day] = order
+        self.deck_len = np.full(n, self.n_cards)
+
+        self.day = np.zeros(n, dtype=np.int64)
+        self.phase = np.full(n, int(Phase.Draw))
+        self.turn_player = np.zeros(n, dtype=np.int64)
+        self.current_player = np.zeros(n, dtype=np.int64)
+        self.winner = np.full(n, -1)
+
+        self.money = np.full((n, p), self.game.kStartingMoney, dtype=np.int64)
+        self.bids = np.full((n, p), -1, dtype=np.int64)
+        self.high_bid = np.zeros(n, dtype=np.int64)
+        self.high_bidder = np.full(n, -1)
+
+        self.ships = np.full((n, p, self.capacity + 1), -1, dtype=np.int64)
+        self.ship_len = np.zeros((n, p), dtype=np.int64)
+        self.ship_value = np.zeros((n, p), dtype=np.int64)
+        self.pyramids = np.zeros((n, Type.Gold, p), dtype=np.int64)
+
+        self.cards_in_play = np.full((n, self.lot_size), -1, dtype=np.int64)
+        self.n_in_play = np.zeros(n, dtype=np.int64)
+        self._deal_lot(self.games)
+
+    def is_terminal(self):
+        return self.phase == Phase.GameOver
+
+    def all_terminal(self):
+        return bool(self.is_terminal().all())
+
+    def _pop(self, g):
+        self.deck_len[g] -= 1
+        return self.decks[g, self.day[g], self.deck_len[g]]
+
+    def _deal_lot(self, g):
+        self.cards_in_play[g] = -1
+        self.cards_in_play[g, 0] = self._pop(g)
+        self.n_in_play[g] = 1
+        self.bids[g] = -1
+        self.high_bid[g] = 0
+        self.high_bidder[g] = -1
+        self.phase[g] = Phase.Draw
+
+    def _next_player(self, players):
+        return (players + 1) % self.n_players
+
+    def legal_bid_range(self):
+        """Returns (min_bid, max_bid) for every game's current player.
+
+        max_bid < min_bid means the player can only pass. Only meaningful for
+        games in the bid phase.
+        """
+        current = self.current_player
+        min_bid = self.high_bid + 1
+        max_bid = self.money[self.games, current].copy()
+        overfull = self.ship_len[self.games, current] + self.n_in_play > self.capacity
+        max_bid[overfull] = 0
+        return min_bid, max_bid
+
+    def can_draw(self):
+        fits = (self.ship_len + self.n_in_play[:, None] + 1 <= self.capacity).any(axis=1)
+        return fits & (self.deck_len > 0)
+
+    def sample_actions(self, rng):
+        """Uniformly random legal action per game, like `RandomBot`."""
+        u = rng.random(self.n_games)
+
+        draw_actions = np.where(
+            self.can_draw() & (u < 0.5), int(DrawAction.Draw), int(DrawAction.Pass))
+
+        min_bid, max_bid = self.legal_bid_range()
+        n_actions = np.maximum(max_bid - min_bid + 1, 0) + 1
+        k = (u * n_actions).astype(np.int64)
+        bid_actions = np.where(k < n_actions - 1, min_bid + k, 0)
+
+        return np.where(self.phase == Phase.Draw, draw_actions, bid_actions)
+
+    def legal_actions_mask(self, out=None):
+        """(n_games, game.num_distinct_actions) 0/1 mask over action ids."""
+        if out is None:
+            out = np.zeros((self.n_games, self.game.num_distinct_actions), dtype=np.int8)
+        ids = np.arange(self.game.num_distinct_actions)
+
+        drawing = self.phase == Phase.Draw
+        bidding = self.phase == Phase.Bid
+        min_bid, max_bid = self.legal_bid_range()
+        bids = ids[None, :] - kBidActionIdOffset
+        in_range = (bids >= min_bid[:, None]) & (bids <= max_bid[:, None])
+        np.copyto(out, bidding[:, None] & (in_range | (bids == 0)))
+        out[:, kPassActionId] = drawing
+        out[:, kDrawActionId] = drawing & self.can_draw()
+        return out
+
+    def observation_tensor(self, player, out=None):
+        """Every game's `MediciState.observation_tensor(player)` at once.
+
+        `out` is an (n_games, game.observation_size) array that is written
+        in place.
+        """
+        n, p, k = self.n_games, self.n_players, self.n_kinds
+        if out is None:
+            out = np.zeros((n, self.game.observation_size), dtype=np.float32)
+        else:
+            out[:] = 0
+        seats = (player + np.arange(p)) % p
+
+        out[:, 0:p] = self.money[:, seats]
+        out[:, p:2 * p] = self.bids[:, seats]
+        offset = 2 * p
+
+        ship_len = self.ship_len[:, seats]
+        ships = self.ships[:, seats]
+        slots = np.arange(self.capacity + 1)
+        has_card = slots[None, None, :] < ship_len[:, :, None]
+        g, i, slot = np.nonzero(has_card)
+        kinds = self.card_kinds[ships[g, i, slot]]
+        counts = np.bincount((g * p + i) * k + kinds, minlength=n * p * k)
+        out[:, offset:offset + p * k] = counts.reshape(n, p * k)
+        offset += p * k
+
+        out[:, offset:offset + Type.Gold * p] = self.pyramids[:, :, seats].reshape(n, -1)
+        offset += Type.Gold * p
+
+        g, slot = np.nonzero(np.arange(self.lot_size)[None, :] < self.n_in_play[:, None])
+        kinds = self.card_kinds[self.cards_in_play[g, slot]]
+        out[:, offset:offset + k] = np.bincount(g * k + kinds, minlength=n * k).reshape(n, k)
+        offset += k
+
+        deck = self.decks[self.games, np.minimum(self.day, self.n_days - 1)]
+        g, slot = np.nonzero(np.arange(self.n_cards)[None, :] < self.deck_len[:, None])
+        kinds = self.card_kinds[deck[g, slot]]
+        out[:, offset:offset + k] = np.bincount(g * k + kinds, minlength=n * k).reshape(n, k)
+        offset += k
+
+        out[self.games, offset + self.phase] = 1
+        offset += len(Phase)
+        out[self.games, offset + self.day] = 1
+        offset += self.game.n_days
+        out[self.games, offset + (self.current_player - player) % p] = 1
+        offset += p
+        out[self.games, offset + (self.turn_player - player) % p] = 1
+        return out
+
+    def step_action_ids(self, action_ids):
+        """Like `step`, with actions given as `medici.encode_action` ids."""
+        self.step(np.where(self.phase == Phase.Bid, action_ids - kBidActionIdOffset, action_ids))
+
+    def step(self, actions):
+        """Applies one action per game; finished games ignore theirs."""
+        phase = self.phase.copy()
+        current = self.current_player.copy()
+
+        # draw phase: pass straight to bidding
+        g = np.nonzero((phase == Phase.Draw) & (actions == DrawAction.Pass))[0]
+        self.current_player[g] = self._next_player(current[g])
+        self.phase[g] = Phase.Bid
+
+        # draw phase: add a card to the lot
+        g = np.nonzero((phase == Phase.Draw) & (actions == DrawAction.Draw))[0]
+        self.cards_in_play[g, self.n_in_play[g]] = self._pop(g)
+        self.n_in_play[g] += 1
+        g = g[self.n_in_play[g] == self.lot_size]
+        self.current_player[g] = self._next_player(current[g])
+        self.phase[g] = Phase.Bid
+
+        # bid phase
+        bidding = phase == Phase.Bid
+        g = np.nonzero(bidding)[0]
+        bidder = current[g]
+        bid = actions[g]
+        self.bids[g, bidder] = bid
+        higher = bid > self.high_bid[g]
+        self.high_bid[g[higher]] = bid[higher]
+        self.high_bidder[g[higher]] = bidder[higher]
+
+        done = (bidder == self.turn_player[g]) | (self.deck_len[g] == 0)
+        moving = g[~done]
+        self.current_player[moving] = self._next_player(current[moving])
+        self._complete_auction(g[done])
+
+    def _complete_auction(self, g):
+        won = g[self.high_bidder[g] >= 0]
+        winner = self.high_bidder[won]
+        self.money[won, winner] -= self.high_bid[won]
+        for slot in range(self.lot_size):
+            has_card = slot < self.n_in_play[won]
+            h, w = won[has_card], winner[has_card]
+            card = self.cards_in_play[h, slot]
+            self.ships[h, w, self.ship_len[h, w]] = card
+            self.ship_len[h, w] += 1
+            self.ship_value[h, w] += self.card_values[card]
+            resource = self.card_types[card]
+            goods = resource != Type.Gold
+            self.pyramids[h[goods], resource[goods], w[goods]] += 1
+
+        # check if day is over
+        full = self.ship_len[g] >= self.capacity
+        but_one_full = full.sum(axis=1) == self.n_players - 1
+        filling = g[but_one_full]
+        self._complete_ship(filling, np.argmin(full[but_one_full], axis=1))
+
+        rest = g[~but_one_full]
+        out_of_cards = self.deck_len[rest] == 0
+        self._complete_day(np.concatenate([filling, rest[out_of_cards]]))
+
+        g = rest[~out_of_cards]
+        self._deal_lot(g)
+        turn = self._next_player(self.turn_player[g])
+        for _ in range(self.n_players):
+            is_full = self.ship_len[g, turn] >= self.capacity
+            turn[is_full] = self._next_player(turn[is_full])
+        self.turn_player[g] = turn
+        self.current_player[g] = turn
+
+    def _complete_ship(self, g, ship):
+        for _ in range(self.capacity + 1):
+            filling = (self.ship_len[g, ship] <= self.capacity) & (self.deck_len[g] > 0)
+            g, ship = g[filling], ship[filling]
+            card = self._pop(g)
+            self.ships[g, ship, self.ship_len[g, ship]] = card
+            self.ship_len[g, ship] += 1
+            self.ship_value[g, ship] += self.card_values[card]
+
+    def _complete_day(self, g):
+        self.money[g] += score_day(self.game, self.ship_value[g], self.pyramids[g])
+
+        self.ships[g] = -1
+        self.ship_len[g] = 0
+        self.ship_value[g] = 0
+
+        last_day = self.day[g] == self.n_days - 1
+        over = g[last_day]
+        self.phase[over] = Phase.GameOver
+        self.winner[over] = np.argmax(self.money[over], axis=1)
+
+        g = g[~last_day]
+        self.day[g] += 1
+        self.deck_len[g] = self.n_cards
+        self._deal_lot(g)
+        start_player = np.argmin(self.money[g], axis=1)
+        self.turn_player[g] = start_player
+        self.current_player[g] = start_player
+
+    def random_playouts(self, rng, record=False):
+        """Plays every game to the end with uniformly random actions.
+
+        With `record`, returns the action taken by each game at every step
+        as a list of arrays (-1 once a game is over).
+        """
+        history = []
+        while not self.all_terminal():
+            actions = self.sample_actions(rng)
+            actions[self.is_terminal()] = -1
+            self.step(actions)
+            if record:
+                history.append(actions)
+        return history
+
+
+def scalar_action(phase, action):
+    if phase == Phase.Draw:
+        return DrawAction(action)
+    return medici.BidAction(int(action))
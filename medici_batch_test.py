@@ -0,0 +1,87 @@
+import random
+
+import numpy as np
+
+import medici
+import medici_batch
+
+
+def test_matches_scalar_engine(n_games = 100, rules = None):
+    game = medici.MediciGame(rules)
+    seeds = list(range(n_games))
+    env = medici_batch.BatchMediciEnv(game, seeds)
+    history = env.random_playouts(np.random.default_rng(0), record=True)
+    assert env.all_terminal()
+
+    for i, seed in enumerate(seeds):
+        state = game.InitialState(random.Random(seed))
+        for actions in history:
+            if actions[i] < 0:
+                break
+            state.DoApplyAction(medici_batch.scalar_action(state.phase, actions[i]))
+
+        assert state.IsTerminal()
+        assert state.money == env.money[i].tolist()
+        assert state.winner == env.winner[i]
+        assert state.pyramids == env.pyramids[i].tolist()
+
+
+def test_variants_match_scalar_engine():
+    test_matches_scalar_engine(20, medici.MediciRules(n_players=2, ship_capacity=4))
+    test_matches_scalar_engine(20, medici.MediciRules(n_players=6, max_lot_size=2, n_days=2, starting_money=25))
+
+
+def test_score_day(n_games = 500):
+    game = medici.MediciGame(log_mode=medici.LogMode.Off)
+    rng = np.random.default_rng(2)
+    p = game.n_players
+    # small ranges so that ties are common
+    ship_values = rng.integers(0, rng.integers(1, 30, size=(n_games, 1)) + 1, size=(n_games, p))
+    pyramids = rng.integers(0, rng.integers(1, 12, size=(n_games, 1, 1)) + 1, size=(n_games, medici.Type.Gold, p))
+    payouts = medici_batch.score_day(game, ship_values, pyramids)
+    # the tables belong to the rules, not to each game
+    assert medici_batch.scoring_tables(game.rules) is medici_batch.scoring_tables(medici.MediciGame().rules)
+
+    for i in range(n_games):
+        state = game.InitialState(random.Random(i))
+        state.money = [0] * p
+        state.ship_values = ship_values[i].tolist()
+        state.pyramids = pyramids[i].tolist()
+        for resource in range(medici.Type.Gold):
+            state.UpdatePyramidLeaders(resource)
+        state.DoScoring()
+        assert state.money == payouts[i].tolist()
+        assert game.ScoreDay(state.ship_values, state.pyramids) == state.money
+
+
+def test_observations_match_scalar_engine(n_games = 10):
+    game = medici.MediciGame()
+    seeds = list(range(n_games))
+    env = medici_batch.BatchMediciEnv(game, seeds)
+    states = [game.InitialState(random.Random(seed)) for seed in seeds]
+    rng = np.random.default_rng(1)
+
+    while not env.all_terminal():
+        player = int(rng.integers(game.n_players))
+        observations = env.observation_tensor(player)
+        masks = env.legal_actions_mask()
+        for i, state in enumerate(states):
+            assert (observations[i] == state.observation_tensor(player)).all()
+            assert (masks[i] == state.LegalActionsMask()).all()
+
+        actions = env.sample_actions(rng)
+        action_ids = np.full(n_games, -1)
+        for i, state in enumerate(states):
+            if not state.IsTerminal():
+                action = medici_batch.scalar_action(state.phase, actions[i])
+                action_ids[i] = medici.encode_action(action)
+                assert medici.decode_action(action_ids[i]) == action
+                state.DoApplyAction(action)
+        env.step_action_ids(action_ids)
+
+    for i, state in enumerate(states):
+        assert state.money == env.money[i].tolist()
+
+
+if __name__ == "__main__":
+    test_matches_scalar_engine()
@@ -0,0 +1,292 @@
+import argparse
+import copy
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import medici
+
+
+def random_midgame_states(game, n_states, seed=0):
+    random.seed(seed)
+    states = []
+    for i in range(n_states):
+        state = game.InitialState()
+        for _ in range(random.randrange(1, 60)):
+            if state.IsTerminal():
+                break
+            state.DoApplyAction(random.choice(state.LegalActions()))
+        states.append(state)
+    return states
+
+
+def random_playout(state):
+    while not state.IsTerminal():
+        state.DoApplyAction(random.choice(state.LegalActions()))
+    return state
+
+
+def deepcopy_state(state):
+    # the game is shared, not part of the state, as it is for Clone()
+    return copy.deepcopy(state, {id(state.game): state.game})
+
+
+def bench_clone(n_states=200, n_copies=20, seed=0):
+    game = medici.MediciGame()
+    states = random_midgame_states(game, n_states, seed)
+
+    start = time.perf_counter()
+    for state in states:
+        for _ in range(n_copies):
+            deepcopy_state(state)
+    deepcopy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for state in states:
+        for _ in range(n_copies):
+            state.Clone()
+    clone_time = time.perf_counter() - start
+
+    random.seed(seed)
+    start = time.perf_counter()
+    for state in states:
+        random_playout(deepcopy_state(state))
+    deepcopy_playout_time = time.perf_counter() - start
+
+    random.seed(seed)
+    start = time.perf_counter()
+    for state in states:
+        random_playout(state.Clone())
+    clone_playout_time = time.perf_counter() - start
+
+    n = n_states * n_copies
+    return {
+        "deepcopy_us": 1e6 * deepcopy_time / n,
+        "clone_us": 1e6 * clone_time / n,
+        "clone_speedup": deepcopy_time / clone_time,
+        "deepcopy_playout_us": 1e6 * deepcopy_playout_time / n_states,
+        "clone_playout_us": 1e6 * clone_playout_time / n_states,
+        # the playout itself dominates both, so this is far below clone_speedup
+        "clone_playout_speedup": deepcopy_playout_time / clone_playout_time,
+    }
+
+
+def play_seeded_game(game, seed):
+    state = game.InitialState(random.Random(seed))
+    bot = medici.RandomBot(random.Random(seed + 1))
+    actions = []
+    while not state.IsTerminal():
+        action = bot.ChooseAction(state)
+        actions.append(action)
+        state.DoApplyAction(action)
+    return state, actions
+
+
+def best_time(run, repeat):
+    """The fastest of `repeat` calls to `run`, which returns the seconds it
+    measured."""
+    return min(run() for _ in range(repeat))
+
+
+def bench_playouts(n_games=200, seed=0, repeat=5):
+    metrics = {}
+    for name, log_mode in [("off", medici.LogMode.Off), ("text", medici.LogMode.Text)]:
+        game = medici.MediciGame(log_mode=log_mode)
+
+        def run():
+            start = time.perf_counter()
+            for i in range(n_games):
+                play_seeded_game(game, seed + i)
+            return time.perf_counter() - start
+
+        metrics[f"playout_{name}_games_per_s"] = n_games / best_time(run, repeat)
+    return metrics
+
+
+class CapturingState(medici.MediciState):
+    # keeps a copy of the state just before each auction completes and
+    # each day is scored, so those steps can be timed in isolation
+    __slots__ = ()
+    captured_auctions = None
+    captured_scorings = None
+
+    def Snapshot(self):
+        state = self.Clone()
+        state.__class__ = medici.MediciState
+        return state
+
+    def CompleteAuction(self):
+        self.captured_auctions.append(self.Snapshot())
+        super().CompleteAuction()
+
+    def DoScoring(self):
+        self.captured_scorings.append(self.Snapshot())
+        super().DoScoring()
+
+
+def capture_states(game, n_games, seed):
+    """Seeded games with the states seen before every action, before every
+    auction completes and before every day is scored."""
+    CapturingState.captured_auctions = auctions = []
+    CapturingState.captured_scorings = scorings = []
+    before_actions = []
+    action_lists = []
+    for i in range(n_games):
+        state = CapturingState(game, random.Random(seed + i))
+        bot = medici.RandomBot(random.Random(seed + i + 1))
+        actions = []
+        while not state.IsTerminal():
+            before_actions.append(state.Clone())
+            action = bot.ChooseAction(state)
+            actions.append(action)
+            state.DoApplyAction(action)
+        action_lists.append(actions)
+    return before_actions, auctions, scorings, action_lists
+
+
+def time_per_call(states, method, repeat, min_calls=2000):
+    # calls mutate their state, so every repeat works on fresh clones
+    copies = -(-min_calls // len(states))
+    def run():
+        clones = [state.Clone() for state in states for _ in range(copies)]
+        start = time.perf_counter()
+        for state in clones:
+            method(state)
+        return time.perf_counter() - start
+    return 1e9 * best_time(run, repeat) / (len(states) * copies)
+
+
+def bench_engine(n_games=50, seed=0, repeat=5, frontend_passes=20):
+    game = medici.MediciGame(log_mode=medici.LogMode.Off)
+    before_actions, auctions, scorings, action_lists = capture_states(game, n_games, seed)
+    metrics = {}
+
+    def run_legal_actions():
+        start = time.perf_counter()
+        for state in before_actions:
+            state.LegalActions()
+        return time.perf_counter() - start
+    metrics["legal_actions_ns"] = 1e9 * best_time(run_legal_actions, repeat) / len(before_actions)
+
+    def run_apply():
+        games = [(game.InitialState(random.Random(seed + i)), actions)
+                 for i, actions in enumerate(action_lists)]
+        start = time.perf_counter()
+        for state, actions in games:
+            for action in actions:
+                state.DoApplyAction(action)
+        return time.perf_counter() - start
+    n_actions = sum(len(actions) for actions in action_lists)
+    metrics["do_apply_action_ns"] = 1e9 * best_time(run_apply, repeat) / n_actions
+
+    metrics["complete_auction_ns"] = time_per_call(auctions, medici.MediciState.CompleteAuction, repeat)
+    metrics["do_scoring_ns"] = time_per_call(scorings, medici.MediciState.DoScoring, repeat)
+
+    # frontend snapshots, with the text log a frontend shows, bypassing the
+    # per-version cache
+    text_game = medici.MediciGame(log_mode=medici.LogMode.Text)
+    states = []
+    for i in range(n_games):
+        state = text_game.InitialState(random.Random(seed + i))
+        for action in action_lists[i][:len(action_lists[i]) // 2]:
+            state.DoApplyAction(action)
+        states.append(state)
+
+    def run_frontend():
+        start = time.perf_counter()
+        for _ in range(frontend_passes):
+            for state in states:
+                state.frontend_cache = None
+                state.frontend_state()
+        return time.perf_counter() - start
+    metrics["frontend_state_ns"] = 1e9 * best_time(run_frontend, repeat) / (len(states) * frontend_passes)
+    return metrics
+
+
+def bench_memory(n_games=20, seed=0):
+    """Peak bytes allocated while playing one game, start to finish."""
+    metrics = {}
+    for name, log_mode in [("off", medici.LogMode.Off), ("text", medici.LogMode.Text)]:
+        game = medici.MediciGame(log_mode=log_mode)
+        total = 0
+        tracemalloc.start()
+        for i in range(n_games):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            state = play_seeded_game(game, seed + i)
+            total += tracemalloc.get_traced_memory()[1] - base
+            del state
+        tracemalloc.stop()
+        metrics[f"game_peak_{name}_bytes"] = total / n_games
+    return metrics
+
+
+def run_benchmarks(quick=False, seed=0):
+    scale = 10 if quick else 1
+    metrics = {}
+    metrics.update(bench_playouts(n_games=200 // scale, seed=seed))
+    metrics.update(bench_engine(n_games=50 // scale, seed=seed))
+    metrics.update(bench_memory(n_games=20 // scale, seed=seed))
+    metrics.update(bench_clone(n_states=200 // scale, seed=seed))
+    return metrics
+
+
+def higher_is_better(metric):
+    return metric.endswith("_per_s") or metric.endswith("_speedup")
+
+
+def regressions(metrics, baseline, tolerance):
+    """Metrics more than `tolerance` (a fraction) worse than the baseline,
+    as (name, value, baseline value) triples."""
+    worse = []
+    for name, base in baseline.items():
+        if name not in metrics:
+            continue
+        value = metrics[name]
+        if higher_is_better(name):
+            regressed = value < base * (1 - tolerance)
+        else:
+            regressed = value > base * (1 + tolerance)
+        if regressed:
+            worse.append((name, value, base))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Medici engine.")
+    parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+    parser.add_argument("--baseline", default=None, help="fail on regressions against this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown against the baseline, as a fraction")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="a tenth of the work, for smoke tests")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "quick": args.quick,
+        "metrics": run_benchmarks(args.quick, args.seed),
+    }
+    text = json.dumps(results, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["metrics"]
+        worse = regressions(results["metrics"], baseline, args.tolerance)
+        for name, value, base in worse:
+            print(f"REGRESSION {name}: {value:.2f} vs baseline {base:.2f}", file=sys.stderr)
+        if worse:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
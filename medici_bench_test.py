@@ -0,0 +1,27 @@
+import medici_bench
+
+
+def test_regressions():
+    baseline = {"playout_off_games_per_s": 500.0, "legal_actions_ns": 1000.0}
+    assert medici_bench.regressions(baseline, baseline, 0.1) == []
+    assert medici_bench.regressions(
+        {"playout_off_games_per_s": 460.0, "legal_actions_ns": 1090.0}, baseline, 0.1) == []
+
+    worse = medici_bench.regressions(
+        {"playout_off_games_per_s": 400.0, "legal_actions_ns": 1200.0}, baseline, 0.1)
+    assert [name for name, _, _ in worse] == ["playout_off_games_per_s", "legal_actions_ns"]
+
+
+def test_benchmarks_run():
+    metrics = medici_bench.run_benchmarks(quick=True)
+    for name in ["playout_off_games_per_s", "legal_actions_ns", "do_apply_action_ns",
+                 "complete_auction_ns", "do_scoring_ns", "frontend_state_ns",
+                 "game_peak_text_bytes"]:
+        assert metrics[name] > 0
+    # logging off must not cost memory
+    assert metrics["game_peak_off_bytes"] < metrics["game_peak_text_bytes"]
+
+
+if __name__ == "__main__":
+    test_regressions()
+    test_benchmarks_run()
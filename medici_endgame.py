@@ -0,0 +1,255 @@
+import random
+
+import medici
+from medici import Phase
+
+
+class EndgameState(medici.MediciState):
+    # counts the cards popped from the deck of the day being solved, so
+    # the solver knows how many chance events an action involves
+    __slots__ = ("pops", "solve_day")
+
+    def Clone(self, log_mode=medici.LogMode.Off):
+        state = super().Clone(log_mode)
+        state.pops = 0
+        state.solve_day = self.solve_day
+        return state
+
+    def PopDeck(self):
+        if self.day == self.solve_day:
+            self.pops += 1
+        return super().PopDeck()
+
+
+def endgame_state(state):
+    clone = state.Clone()
+    endgame = EndgameState.__new__(EndgameState)
+    for name in medici.MediciState.__slots__:
+        setattr(endgame, name, getattr(clone, name))
+    endgame.pops = 0
+    endgame.solve_day = state.day
+    # the deck of the next day is never looked at, but must not come from
+    # the game's own rng
+    endgame.rng = random.Random(0)
+    return endgame
+
+
+def canonical_key(state):
+    # everything the rest of the day depends on; ships only matter through
+    # their fill and value, and the hidden deck through its multiset
+    kinds = state.game.card_kind_index
+    return (
+        state.phase, state.current_player, state.turn_player,
+        tuple(state.money),
+        tuple(state.bids.get(player, -1) for player in range(state.game.n_players)),
+        tuple(zip(map(len, state.ships), state.ship_values)),
+        tuple(map(tuple, state.pyramids)),
+        tuple(sorted(kinds[card] for card in state.cards_in_play)),
+        tuple(state.deck_counts),
+    )
+
+
+def deal_sequences(counts, n):
+    """Distinct sequences of `n` card kinds drawn from a deck with `counts`
+    copies of each kind, with their probabilities."""
+    if n == 0:
+        yield (), 1.0
+        return
+    total = sum(counts)
+    for kind, count in enumerate(counts):
+        if count:
+            counts[kind] -= 1
+            for sequence, p in deal_sequences(counts, n - 1):
+                yield (kind,) + sequence, p * count / total
+            counts[kind] += 1
+
+
+def shifted(value, player, amount):
+    value = list(value)
+    value[player] -= amount
+    return tuple(value)
+
+
+class EndgameSolver:
+    """Expected day-end money for every player once the deck is nearly empty.
+
+    Players maximize their own expected money at the end of the day (max^n)
+    and every ordering of the remaining deck is equally likely, so each card
+    popped is a chance event over the kinds left. Outcomes that reach the
+    same canonical position are merged, and positions are cached in a
+    bounded `medici.TranspositionTable`.
+
+    An auction is solved by a backward pass over the bidders, using the
+    rest of the day after each possible winner's cheapest winning bid and
+    charging higher bids one for one. This is exact when every win ends the
+    day, as long as the auctions that follow if nobody wins are exact too;
+    otherwise it ignores that a dearer win leaves the winner less to bid
+    with later in the same day.
+    """
+
+    def __init__(self, max_cards=4, cache_size=200_000):
+        self.max_cards = max_cards
+        self.table = medici.TranspositionTable(cache_size)
+
+    def CanSolve(self, state):
+        return not state.is_game_over and len(state.deck) <= self.max_cards
+
+    def Solve(self, state):
+        return self.Value(endgame_state(state))
+
+    def BestAction(self, state):
+        state = endgame_state(state)
+        if state.phase == Phase.Draw:
+            return self.DrawValue(state)[1]
+        return self.AuctionValue(state)[1]
+
+    def Value(self, state):
+        if state.day != state.solve_day or state.is_game_over:
+            return tuple(float(money) for money in state.money)
+        key = canonical_key(state)
+        value = self.table.Lookup(key)
+        if value is None:
+            if state.phase == Phase.Draw:
+                value = self.DrawValue(state)[0]
+            else:
+                value = self.AuctionValue(state)[0]
+            self.table.Store(key, value)
+        return value
+
+    def Outcomes(self, state, action):
+        """(probability, state) pairs for applying `action`, one per distinct
+        position the cards it pops can lead to."""
+        probe = state.Clone()
+        probe.DoApplyAction(action)
+        if probe.pops == 0:
+            return [(1.0, probe)]
+
+        card_kinds = state.game.card_kinds
+        outcomes = {}
+        for sequence, p in deal_sequences(list(state.deck_counts), probe.pops):
+            child = state.Clone()
+            counts = list(state.deck_counts)
+            for kind in sequence:
+                counts[kind] -= 1
+            # the rest of the deck in any order, then the dealt cards on top
+            child.deck = [card_kinds[kind] for kind, count in enumerate(counts) for _ in range(count)]
+            child.deck.extend(card_kinds[kind] for kind in reversed(sequence))
+            child.DoApplyAction(action)
+
+            if child.day != child.solve_day or child.is_game_over:
+                key = tuple(child.money)
+            else:
+                key = canonical_key(child)
+            if key in outcomes:
+                outcomes[key][0] += p
+            else:
+                outcomes[key] = [p, child]
+        return list(outcomes.values())
+
+    def ActionValue(self, state, action):
+        total = [0.0] * state.game.n_players
+        for p, child in self.Outcomes(state, action):
+            for player, money in enumerate(self.Value(child)):
+                total[player] += p * money
+        return tuple(total)
+
+    def DrawValue(self, state):
+        player = state.current_player
+        best_value = None
+        best_action = None
+        for action in state.LegalActions():
+            value = self.ActionValue(state, action)
+            if best_value is None or value[player] > best_value[player]:
+                best_value = value
+                best_action = action
+        return best_value, best_action
+
+    def AuctionValue(self, state):
+        game = state.game
+        bidders = [state.current_player]
+        # with an empty deck the first bid ends the auction
+        if state.deck:
+            player = state.current_player
+            while player != state.turn_player:
+                player = state.NextPlayer(player)
+                bidders.append(player)
+
+        high_bid = state.high_bid
+        high_bidder = -1
+        for player, bid in state.bids.items():
+            if bid > 0:
+                high_bidder = player
+
+        lot_size = len(state.cards_in_play)
+        caps = {player: state.money[player]
+                if len(state.ships[player]) + lot_size <= game.kShipCapacity else 0
+                for player in bidders}
+
+        # the rest of the day for each possible winner, at their cheapest
+        # winning price
+        continuations = {high_bidder: (self.Continuation(state, bidders, None, 0), high_bid)}
+        for player in bidders:
+            if caps[player] > high_bid:
+                continuations[player] = (
+                    self.Continuation(state, bidders, player, high_bid + 1), high_bid + 1)
+
+        top = max([high_bid] + list(caps.values()))
+        highs = range(high_bid, top + 1)
+
+        def after(high, winner):
+            if winner not in continuations:
+                return None
+            value, price = continuations[winner]
+            if winner == -1:
+                return value if high == high_bid else None
+            if high < price:
+                return None
+            return shifted(value, winner, high - price)
+
+        # values[winner][i]: value once the remaining bidders have acted,
+        # given the high bid highs[i] by winner
+        values = {winner: [after(high, winner) for high in highs] for winner in continuations}
+        best_bid = None
+        for i in reversed(range(len(bidders))):
+            bidder = bidders[i]
+            cap = caps[bidder]
+            outbid = values.get(bidder)
+
+            # best bid above each high, preferring the lower of equal bids
+            best_above = [None] * len(highs)
+            running = None
+            for index in reversed(range(len(highs))):
+                best_above[index] = running
+                bid = highs[index]
+                if outbid is not None and 0 < bid <= cap and outbid[index] is not None:
+                    if running is None or outbid[index][bidder] >= running[0][bidder]:
+                        running = (outbid[index], bid)
+
+            new_values = {}
+            for winner, row in values.items():
+                new_row = []
+                for index, passed in enumerate(row):
+                    bid = best_above[index]
+                    if passed is not None and bid is not None and bid[0][bidder] > passed[bidder]:
+                        new_row.append(bid[0])
+                    else:
+                        new_row.append(passed)
+                new_values[winner] = new_row
+            if i == 0:
+                bid = best_above[0]
+                passed = values[high_bidder][0]
+                if bid is not None and bid[0][bidder] > passed[bidder]:
+                    best_bid = bid[1]
+            values = new_values
+
+        action = medici.bid_action(best_bid) if best_bid is not None else medici.bid_actions[0]
+        return values[high_bidder][0], action
+
+    def Continuation(self, state, bidders, winner, price):
+        # everyone passes except `winner`, who bids `price`
+        state = state.Clone()
+        actions = [medici.bid_action(price) if player == winner else medici.bid_actions[0]
+                   for player in bidders]
+        for action in actions[:-1]:
+            state.DoApplyAction(action)
+        return self.ActionValue(state, actions[-1])
@@ -0,0 +1,134 @@
+import random
+
+import medici
+import medici_endgame
+import medici_ismcts
+
+
+def exhaustive_value(solver, state):
+    # max^n over every legal action, preferring to pass on ties as the
+    # solver does
+    if state.day != state.solve_day or state.is_game_over:
+        return tuple(float(money) for money in state.money)
+    legal_actions = state.LegalActions()
+    if state.phase == medici.Phase.Bid:
+        legal_actions = legal_actions[-1:] + legal_actions[:-1]
+    best = None
+    for action in legal_actions:
+        value = [0.0] * state.game.n_players
+        for p, child in solver.Outcomes(state, action):
+            for player, money in enumerate(exhaustive_value(solver, child)):
+                value[player] += p * money
+        if best is None or value[state.current_player] > best[state.current_player] + 1e-9:
+            best = value
+    return tuple(best)
+
+
+def late_state(game, seed, max_cards, rng):
+    state = game.InitialState(random.Random(seed))
+    while not state.IsTerminal() and len(state.deck) > max_cards:
+        state.DoApplyAction(state.SampleLegalAction(rng))
+    return state
+
+
+def test_last_auction_is_exact():
+    game = medici.MediciGame(log_mode=medici.LogMode.Off)
+    rng = random.Random(0)
+    n_checked = 0
+    for seed in range(60):
+        state = late_state(game, seed, 0, rng)
+        if state.IsTerminal():
+            continue
+        state.money = [rng.randrange(8) for _ in range(game.n_players)]
+        solver = medici_endgame.EndgameSolver()
+        value = solver.Solve(state)
+        expected = exhaustive_value(solver, medici_endgame.endgame_state(state))
+        assert max(abs(a - b) for a, b in zip(value, expected)) < 1e-9
+        n_checked += 1
+    assert n_checked > 20
+
+
+def day_ending_buyers(state):
+    """Players who can take the lot, or None unless taking it fills the
+    last ship but one for each of them."""
+    lot_size = len(state.cards_in_play)
+    capacity = state.game.kShipCapacity
+    buyers = []
+    for player, ship in enumerate(state.ships):
+        if len(ship) + lot_size <= capacity:
+            n_full = state.n_full_ships + (len(ship) < capacity <= len(ship) + lot_size)
+            if n_full != state.game.n_players - 1:
+                return None
+            buyers.append(player)
+    return buyers
+
+
+def test_day_ending_auction_is_exact():
+    # With a card left every player bids, so this runs the backward pass
+    # over several bidders. Any win ends the day, and if nobody wins, the
+    # last card is sold to the first bidder, so no later auction in the day
+    # is approximated.
+    game = medici.MediciGame(log_mode=medici.LogMode.Off)
+    rng = random.Random(2)
+    n_checked = 0
+    for seed in range(300):
+        state = game.InitialState(random.Random(seed))
+        while not state.IsTerminal():
+            if state.phase == medici.Phase.Bid and not state.bids and len(state.deck) == 1:
+                buyers = day_ending_buyers(state)
+                if buyers is not None and len(buyers) >= 2:
+                    break
+            state.DoApplyAction(state.SampleLegalAction(rng))
+        if state.IsTerminal():
+            continue
+        state.money = [rng.randrange(1, 8) for _ in range(game.n_players)]
+        solver = medici_endgame.EndgameSolver(max_cards=1)
+        value = solver.Solve(state)
+        expected = exhaustive_value(solver, medici_endgame.endgame_state(state))
+        assert max(abs(a - b) for a, b in zip(value, expected)) < 1e-9
+        n_checked += 1
+    assert n_checked >= 30
+
+
+def test_endgame_solver():
+    game = medici.MediciGame(log_mode=medici.LogMode.Off)
+    rng = random.Random(1)
+    solver = medici_endgame.EndgameSolver(max_cards=3, cache_size=1000)
+    for seed in range(20):
+        state = late_state(game, seed, 3, rng)
+        if not solver.CanSolve(state):
+            continue
+        deck = list(state.deck)
+        value = solver.Solve(state)
+        action = solver.BestAction(state)
+        assert state.IsLegalAction(action)
+        # the solver works on copies and never touches the game's rng
+        assert state.deck == deck
+
+        # the value is the expectation of the chosen action's outcomes
+        endgame = medici_endgame.endgame_state(state)
+        chosen = solver.ActionValue(endgame, action)
+        assert max(abs(a - b) for a, b in zip(value, chosen)) < 1e-9
+    assert len(solver.table) <= 1000
+
+
+def test_ismcts_uses_solver():
+    game = medici.MediciGame(log_mode=medici.LogMode.Off)
+    solver = medici_endgame.EndgameSolver(max_cards=2)
+    bot = medici_ismcts.ISMCTSBot(random.Random(0), time_limit=None, max_iterations=5,
+                                  endgame_solver=solver)
+    state = game.InitialState(random.Random(0))
+    while not state.IsTerminal():
+        action = bot.ChooseAction(state)
+        bot.InformAction(state, action)
+        if solver.CanSolve(state) and len(state.LegalActions()) > 1:
+            assert bot.last_iterations == 0
+            assert action == solver.BestAction(state)
+        state.DoApplyAction(action)
+
+
+if __name__ == "__main__":
+    test_last_auction_is_exact()
+    test_day_ending_auction_is_exact()
+    test_endgame_solver()
+    test_ismcts_uses_solver()
@@ -0,0 +1,246 @@
+import math
+import time
+from array import array
+
+import medici
+
+
+class ISMCTSBot:
+    """Single-observer information set MCTS.
+
+    Every iteration clones the state, shuffles the hidden deck, and walks
+    one tree whose nodes are keyed by integer action id, so nodes are
+    shared by all determinizations. Children are selected with UCB over
+    the number of iterations in which they were legal, and rollouts play
+    random legal actions to the end of the game, scoring 1 for the winner.
+
+    Nodes live in parallel arrays indexed by node id. When the bot is told
+    about every applied action through `InformAction`, the subtree under
+    those actions is kept for the next search. The search stops after
+    `time_limit` seconds or `max_iterations` iterations, whichever comes
+    first.
+
+    With a `medici.TranspositionTable`, statistics are also kept per
+    (position hash, action) pair and used for exploitation, so actions that
+    reach the same position from different histories share results. The
+    table may be shared between bots and kept across moves and games.
+
+    With a `medici_endgame.EndgameSolver`, positions it can solve are
+    played from the solver without searching.
+    """
+
+    def __init__(self, rng=None, time_limit=0.1, max_iterations=None,
+                 exploration=0.7, max_nodes=200_000, transposition_table=None,
+                 endgame_solver=None):
+        self.rng = rng
+        self.transposition_table = transposition_table
+        self.endgame_solver = endgame_solver
+        self.time_limit = time_limit
+        self.max_iterations = max_iterations
+        self.exploration = exploration
+        self.max_nodes = max_nodes
+
+        self.last_iterations = 0
+        self.last_search_time = 0.0
+        self.Reset()
+
+    def Reset(self):
+        self.action = array("i")
+        self.player = array("b")
+        self.first_child = array("i")
+        self.next_sibling = array("i")
+        self.visits = array("i")
+        self.available = array("i")
+        self.reward = array("d")
+        self.root = self.NewNode(-1, -1)
+        self.root_version = None # state version the root corresponds to
+
+    @property
+    def n_nodes(self):
+        return len(self.action)
+
+    @property
+    def iterations_per_second(self):
+        if self.last_search_time == 0:
+            return 0.0
+        return self.last_iterations / self.last_search_time
+
+    def NewNode(self, action_id, player):
+        self.action.append(action_id)
+        self.player.append(player)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self.visits.append(0)
+        self.available.append(0)
+        self.reward.append(0.0)
+        return len(self.action) - 1
+
+    def AddChild(self, parent, action_id, player):
+        child = self.NewNode(action_id, player)
+        self.next_sibling[child] = self.first_child[parent]
+        self.first_child[parent] = child
+        return child
+
+    def FindChild(self, parent, action_id):
+        child = self.first_child[parent]
+        while child != -1 and self.action[child] != action_id:
+            child = self.next_sibling[child]
+        return child
+
+    def Compact(self):
+        # copy the subtree under the root into fresh arrays, dropping nodes
+        # left behind by earlier moves
+        old_action = self.action
+        old_player = self.player
+        old_first_child = self.first_child
+        old_next_sibling = self.next_sibling
+        old_visits = self.visits
+        old_available = self.available
+        old_reward = self.reward
+        root_version = self.root_version
+        old_root = self.root
+        self.Reset()
+        self.root_version = root_version
+        self.visits[self.root] = old_visits[old_root]
+
+        stack = [(old_root, self.root)]
+        while stack:
+            old_node, node = stack.pop()
+            old_child = old_first_child[old_node]
+            while old_child != -1:
+                child = self.AddChild(node, old_action[old_child], old_player[old_child])
+                self.visits[child] = old_visits[old_child]
+                self.available[child] = old_available[old_child]
+                self.reward[child] = old_reward[old_child]
+                stack.append((old_child, child))
+                old_child = old_next_sibling[old_child]
+
+    def Determinize(self, state):
+        belief = medici.DeckBelief(state, state.current_player)
+        state = state.Clone()
+        # searches must not draw future decks from the game's own rng
+        state.rng = self.rng
+        state.deck = belief.SampleDeck(self.rng)
+        return state
+
+    def Iterate(self, root_state):
+        state = self.Determinize(root_state)
+        rng = self.rng
+        table = self.transposition_table
+        action_keys = root_state.game.zobrist.action
+        node = self.root
+        path = [node]
+        path_keys = [] # (position, action) hash per step, with a table
+
+        # selection and expansion
+        while not state.IsTerminal():
+            legal_actions = state.LegalActions()
+            player = state.current_player
+            position = state.ZobristHash() if table is not None else 0
+            best_child = -1
+            best_action = None
+            best_score = -math.inf
+            untried = []
+            for action in legal_actions:
+                action_id = medici.encode_action(action)
+                child = self.FindChild(node, action_id)
+                if child == -1:
+                    untried.append(action)
+                    continue
+                self.available[child] += 1
+                visits = self.visits[child]
+                mean = self.reward[child] / visits
+                if table is not None:
+                    entry = table.Lookup(position ^ action_keys[action_id])
+                    if entry is not None:
+                        mean = entry[1] / entry[0]
+                score = mean + self.exploration * math.sqrt(
+                    math.log(self.available[child]) / visits)
+                if score > best_score:
+                    best_score = score
+                    best_child = child
+                    best_action = action
+
+            if untried:
+                # once the pool is full, iterations only refine existing nodes
+                if self.n_nodes < self.max_nodes:
+                    action = untried[medici.random_index(rng, len(untried))]
+                    action_id = medici.encode_action(action)
+                    child = self.AddChild(node, action_id, player)
+                    self.available[child] += 1
+                    state.DoApplyAction(action)
+                    path.append(child)
+                    path_keys.append(position ^ action_keys[action_id])
+                break
+
+            state.DoApplyAction(best_action)
+            node = best_child
+            path.append(node)
+            path_keys.append(position ^ action_keys[self.action[node]])
+
+        # rollout
+        while not state.IsTerminal():
+            state.DoApplyAction(state.SampleLegalAction(rng))
+
+        # backpropagation
+        winner = state.winner
+        self.visits[path[0]] += 1
+        for i, node in enumerate(path[1:]):
+            self.visits[node] += 1
+            won = self.player[node] == winner
+            if won:
+                self.reward[node] += 1.0
+            if table is not None:
+                entry = table.Lookup(path_keys[i])
+                if entry is None:
+                    entry = [0, 0.0]
+                    table.Store(path_keys[i], entry)
+                entry[0] += 1
+                entry[1] += won
+
+    def ChooseAction(self, state):
+        legal_actions = state.LegalActions()
+        if len(legal_actions) == 1:
+            return legal_actions[0]
+        if self.endgame_solver is not None and self.endgame_solver.CanSolve(state):
+            self.last_iterations = 0
+            self.last_search_time = 0.0
+            return self.endgame_solver.BestAction(state)
+
+        if self.root_version != state.version:
+            self.Reset()
+            self.root_version = state.version
+        elif self.root != 0 and self.n_nodes > self.max_nodes // 2:
+            self.Compact()
+
+        start = time.perf_counter()
+        iterations = 0
+        while True:
+            self.Iterate(state)
+            iterations += 1
+            if self.max_iterations is not None and iterations >= self.max_iterations:
+                break
+            if self.time_limit is not None and time.perf_counter() - start >= self.time_limit:
+                break
+        self.last_iterations = iterations
+        self.last_search_time = time.perf_counter() - start
+
+        best_action = legal_actions[0]
+        best_visits = -1
+        for action in legal_actions:
+            child = self.FindChild(self.root, medici.encode_action(action))
+            if child != -1 and self.visits[child] > best_visits:
+                best_visits = self.visits[child]
+                best_action = action
+        return best_action
+
+    def InformAction(self, state, action):
+        # called with the state before `action` is applied to it
+        if self.root_version != state.version:
+            return
+        child = self.FindChild(self.root, medici.encode_action(action))
+        if child == -1:
+            self.Reset()
+            return
+        self.root = child
+        self.root_version = state.version + 1
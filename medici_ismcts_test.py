@@ -0,0 +1,74 @@
+import random
+
+import medici
+import medici_ismcts
+
+
+def play_game(seed, **kwargs):
+    game = medici.MediciGame()
+    state = game.InitialState(random.Random(seed))
+    bots = [medici_ismcts.ISMCTSBot(random.Random(seed), **kwargs)]
+    bots += [medici.RandomBot(random.Random(seed * 4 + i)) for i in range(3)]
+    actions = []
+    while not state.IsTerminal():
+        action = bots[state.current_player].ChooseAction(state)
+        for bot in bots:
+            bot.InformAction(state, action)
+        state.DoApplyAction(action)
+        actions.append(action)
+    return state, actions
+
+
+def test_ismcts_game():
+    state, actions = play_game(0, time_limit=None, max_iterations=10)
+    again, _ = play_game(0, time_limit=None, max_iterations=10)
+    assert state.money == again.money
+
+    # searching does not touch the game's own deck rng, so the game can be
+    # replayed from its seed and actions
+    replay = medici.MediciGame().InitialState(random.Random(0))
+    for action in actions:
+        replay.DoApplyAction(action)
+    assert replay.money == state.money
+
+
+def test_subtree_reuse_and_time_limit():
+    game = medici.MediciGame()
+    state = game.InitialState(random.Random(1))
+    state.DoApplyAction(medici.DrawAction.Pass)
+    bot = medici_ismcts.ISMCTSBot(random.Random(1), time_limit=0.02)
+
+    action = bot.ChooseAction(state)
+    assert bot.last_search_time < 0.5
+    assert bot.last_iterations > 0
+    assert bot.iterations_per_second > 0
+
+    root = bot.root
+    child = bot.FindChild(root, medici.encode_action(action))
+    visits = bot.visits[child]
+    bot.InformAction(state, action)
+    state.DoApplyAction(action)
+    assert bot.root == child
+    assert bot.root_version == state.version
+
+    bot.max_iterations = 5
+    bot.ChooseAction(state)
+    assert bot.visits[bot.root] >= visits + 5
+
+    bot.Compact()
+    assert bot.root == 0
+    assert bot.visits[0] >= visits + 5
+
+
+def test_transposition_table():
+    table = medici.TranspositionTable(capacity=1000)
+    state, _ = play_game(2, time_limit=None, max_iterations=10,
+                         transposition_table=table)
+    assert state.IsTerminal()
+    assert 0 < len(table) <= 1000
+
+
+if __name__ == "__main__":
+    test_ismcts_game()
+    test_subtree_reuse_and_time_limit()
+    test_transposition_table()
@@ -0,0 +1,186 @@
+import dataclasses
+import hashlib
+import mmap
+import random
+import struct
+import sys
+from array import array
+from typing import NamedTuple
+
+import medici
+
+
+# A record file is a header followed by fixed-width records, one per game:
+# the seed the game was dealt from (a u64 for `random.Random(seed)`), the
+# number of actions, then that many u16 action ids padded with zeros to
+# `max_actions`. All integers are little-endian.
+kMagic = b"MDCR"
+kFormatVersion = 2
+# magic, version, max_actions, n_players, n_days, rules fingerprint
+kHeader = struct.Struct("<4sHHHH4xQ")
+kRecordHead = struct.Struct("<QH") # seed, n_actions
+
+
+def rules_fingerprint(rules):
+    # the same across processes and Python versions, unlike hash()
+    digest = hashlib.blake2b(repr(dataclasses.astuple(rules)).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def max_game_actions(game):
+    # every auction uses up at least one card of the deck, and takes at
+    # most one draw per card in the lot, a pass and one bid per player
+    deck_size = len(game.all_cards)
+    return game.n_days * deck_size * (game.n_players + 2)
+
+
+class GameRecord(NamedTuple):
+    seed: int
+    action_ids: array # u16 action ids, in order
+
+
+def ids_to_bytes(action_ids):
+    ids = array("H", action_ids)
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return ids.tobytes()
+
+
+def ids_from_bytes(data):
+    ids = array("H")
+    ids.frombytes(data)
+    if sys.byteorder == "big":
+        ids.byteswap()
+    return ids
+
+
+class GameRecordWriter:
+    """Appends games to a record file.
+
+    Opening an existing file appends to it, after checking that its header
+    matches `max_actions` and the rules of `game`. A partly written last
+    record, left by a crash, is cut off first so new records stay aligned.
+    Every record is flushed as it is written.
+    """
+
+    def __init__(self, path, game, max_actions=None):
+        if max_actions is None:
+            max_actions = max_game_actions(game)
+        self.max_actions = max_actions
+        self.record_size = kRecordHead.size + 2 * max_actions
+        header = kHeader.pack(kMagic, kFormatVersion, max_actions, game.n_players, game.n_days,
+                              rules_fingerprint(game.rules))
+
+        self.file = open(path, "a+b")
+        self.file.seek(0)
+        existing = self.file.read(kHeader.size)
+        if not existing:
+            self.file.write(header)
+        elif existing != header:
+            self.file.close()
+            raise ValueError(f"{path} was written for a different game or record size")
+        size = self.file.seek(0, 2)
+        if size > kHeader.size:
+            n_records = (size - kHeader.size) // self.record_size
+            self.file.truncate(kHeader.size + n_records * self.record_size)
+            self.file.seek(0, 2)
+
+    def write(self, seed, action_ids):
+        n_actions = len(action_ids)
+        if n_actions > self.max_actions:
+            raise ValueError(f"game has {n_actions} actions, records hold at most {self.max_actions}")
+        self.file.write(kRecordHead.pack(seed, n_actions) + ids_to_bytes(action_ids)
+                        + bytes(2 * (self.max_actions - n_actions)))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GameRecordReader:
+    """Random access to the games in a record file through a memory map.
+
+    `reader[i]` decodes the i-th game; `to_numpy()` views the whole file as
+    a NumPy structured array without copying it.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < kHeader.size:
+            self.close()
+            raise ValueError(f"{path} is not a version {kFormatVersion} game record file")
+        magic, version, max_actions, n_players, n_days, fingerprint = kHeader.unpack_from(self.mmap, 0)
+        if magic != kMagic or version != kFormatVersion:
+            self.close()
+            raise ValueError(f"{path} is not a version {kFormatVersion} game record file")
+        self.max_actions = max_actions
+        self.n_players = n_players
+        self.n_days = n_days
+        self.rules_fingerprint = fingerprint
+        self.record_size = kRecordHead.size + 2 * max_actions
+        # a partly written last record is ignored
+        self.n_records = (len(self.mmap) - kHeader.size) // self.record_size
+
+    def __len__(self):
+        return self.n_records
+
+    def check_game(self, game):
+        """Raises ValueError unless the games were written for the rules of
+        `game`, so `replay` against it rebuilds the recorded states."""
+        if self.rules_fingerprint != rules_fingerprint(game.rules):
+            raise ValueError("the records were written for different rules")
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.n_records
+        if not 0 <= index < self.n_records:
+            raise IndexError("game record index out of range")
+        offset = kHeader.size + index * self.record_size
+        seed, n_actions = kRecordHead.unpack_from(self.mmap, offset)
+        start = offset + kRecordHead.size
+        return GameRecord(seed, ids_from_bytes(self.mmap[start:start + 2 * n_actions]))
+
+    def __iter__(self):
+        for index in range(self.n_records):
+            yield self[index]
+
+    def to_numpy(self):
+        """All records as a structured array with fields seed, n_actions and
+        actions (padded to `max_actions`), backed by the memory map. The
+        reader can only be closed once the array is gone."""
+        import numpy as np
+        dtype = np.dtype([
+            ("seed", "<u8"),
+            ("n_actions", "<u2"),
+            ("actions", "<u2", (self.max_actions,)),
+        ])
+        return np.frombuffer(self.mmap, dtype=dtype, count=self.n_records, offset=kHeader.size)
+
+    def close(self):
+        self.mmap.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def replay(game, record, n_actions=None):
+    """Rebuilds the state after the first `n_actions` actions of a record
+    (all of them by default)."""
+    state = game.InitialState(random.Random(record.seed))
+    action_ids = record.action_ids
+    if n_actions is not None:
+        action_ids = action_ids[:n_actions]
+    for action_id in action_ids:
+        state.DoApplyAction(medici.decode_action(action_id))
+    return state
@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+import medici
+import medici_records
+
+
+def play_recorded_game(game, seed):
+    state = game.InitialState(random.Random(seed))
+    bot = medici.RandomBot(random.Random(seed + 1))
+    action_ids = []
+    while not state.IsTerminal():
+        action = bot.ChooseAction(state)
+        action_ids.append(medici.encode_action(action))
+        state.DoApplyAction(action)
+    return state, action_ids
+
+
+def test_game_records(tmp_path):
+    game = medici.MediciGame()
+    path = tmp_path / "games.mdcr"
+    seeds = [3, 1_000_003 * 7 + 5, 42]
+
+    games = []
+    with medici_records.GameRecordWriter(path, game) as writer:
+        for seed in seeds[:2]:
+            state, action_ids = play_recorded_game(game, seed)
+            writer.write(seed, action_ids)
+            games.append((state, action_ids))
+    # reopening appends
+    with medici_records.GameRecordWriter(path, game) as writer:
+        state, action_ids = play_recorded_game(game, seeds[2])
+        writer.write(seeds[2], action_ids)
+        games.append((state, action_ids))
+
+    with medici_records.GameRecordReader(path) as reader:
+        assert len(reader) == 3
+        for index in [2, 0, 1]:
+            record = reader[index]
+            state, action_ids = games[index]
+            assert record.seed == seeds[index]
+            assert list(record.action_ids) == action_ids
+            replayed = medici_records.replay(game, record)
+            assert replayed.ToString() == state.ToString()
+            assert replayed.logs == state.logs
+        assert reader[-1].seed == seeds[2]
+
+        # intermediate states
+        record = reader[0]
+        state = game.InitialState(random.Random(record.seed))
+        for action_id in record.action_ids[:50]:
+            state.DoApplyAction(medici.decode_action(action_id))
+        assert medici_records.replay(game, record, 50).ToString() == state.ToString()
+
+        np = pytest.importorskip("numpy")
+        records = reader.to_numpy()
+        assert list(records["seed"]) == seeds
+        n_actions = records["n_actions"][1]
+        assert list(records["actions"][1, :n_actions]) == games[1][1]
+        del records
+
+    with pytest.raises(ValueError):
+        medici_records.GameRecordWriter(path, game, max_actions=10)
+
+    # games under other rules neither append to nor replay from the file
+    variant = medici.MediciGame(medici.MediciRules(ship_capacity=4))
+    with pytest.raises(ValueError):
+        medici_records.GameRecordWriter(path, variant, max_actions=medici_records.max_game_actions(game))
+    with medici_records.GameRecordReader(path) as reader:
+        assert reader.rules_fingerprint == medici_records.rules_fingerprint(medici.default_rules)
+        reader.check_game(game)
+        with pytest.raises(ValueError):
+            reader.check_game(variant)
+
+
+def test_append_after_torn_record(tmp_path):
+    game = medici.MediciGame()
+    path = tmp_path / "games.mdcr"
+    games = [play_recorded_game(game, seed)[1] for seed in [1, 2]]
+    with medici_records.GameRecordWriter(path, game) as writer:
+        writer.write(1, games[0])
+    # a crash part way through the next record
+    with open(path, "ab") as f:
+        f.write(bytes(range(100)))
+
+    with medici_records.GameRecordWriter(path, game) as writer:
+        writer.write(2, games[1])
+    with medici_records.GameRecordReader(path) as reader:
+        assert len(reader) == 2
+        assert [(record.seed, list(record.action_ids)) for record in reader] == [(1, games[0]), (2, games[1])]
+
+
+if __name__ == "__main__":
+    import pathlib
+    import tempfile
+    test_game_records(pathlib.Path(tempfile.mkdtemp()))
+    test_append_after_torn_record(pathlib.Path(tempfile.mkdtemp()))
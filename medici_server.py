@@ -0,0 +1,299 @@
+import asyncio
+import random
+
+import medici
+import medici_tournament
+
+
+def apply_frontend_diff(snapshot, diff):
+    """Brings a full frontend snapshot up to date with the result of
+    `frontend_state_since`, which may itself be a full snapshot."""
+    if diff["full"]:
+        return diff
+    state = dict(snapshot)
+    state.update({key: value for key, value in diff.items()
+                  if key not in ("players", "pyramids", "deck_removed", "logs")})
+    state["full"] = True
+    state["players"] = list(snapshot["players"])
+    for player in diff["players"]:
+        state["players"][player["id"]] = player
+    state["pyramids"] = dict(snapshot["pyramids"], **diff["pyramids"])
+    state["deck"] = snapshot["deck"][:len(snapshot["deck"]) - diff["deck_removed"]]
+    state["logs"] = diff["logs"] + snapshot["logs"]
+    return state
+
+
+class Subscription:
+    """A bounded queue of frontend updates for one subscriber.
+
+    Each update is a diff from the previous one, and the first is a full
+    snapshot. When a slow subscriber's queue is full, its backlog is
+    replaced by a single diff from the last update it took, so pushes never
+    wait on subscribers and no change is lost.
+    """
+
+    def __init__(self, state, max_queued):
+        if max_queued < 2:
+            raise ValueError("a subscription must hold at least two updates")
+        self.queue = asyncio.Queue(max_queued)
+        self.received_version = None # version of the last update taken
+        self.pushed_version = None # version of the last update queued
+        self.closed = False
+        self.Push(state)
+
+    def Push(self, state):
+        if self.closed or self.pushed_version == state.version:
+            return
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.pushed_version = self.received_version
+        if self.pushed_version is None:
+            update = state.frontend_state()
+        else:
+            update = state.frontend_state_since(self.pushed_version)
+        self.queue.put_nowait(update)
+        self.pushed_version = state.version
+
+    def Close(self, state):
+        if self.closed:
+            return
+        if self.queue.full():
+            # collapse the backlog as Push does, leaving room for the end
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if self.received_version is None:
+                update = state.frontend_state()
+            else:
+                update = state.frontend_state_since(self.received_version)
+            self.queue.put_nowait(update)
+            self.pushed_version = state.version
+        self.closed = True
+        self.queue.put_nowait(None)
+
+    async def Get(self):
+        """The next update, or None once the game is closed."""
+        update = await self.queue.get()
+        if update is not None:
+            self.received_version = update["version"]
+        return update
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        update = await self.Get()
+        if update is None:
+            raise StopAsyncIteration
+        return update
+
+
+class GameSession:
+    """One game and the task that owns it.
+
+    Only the session task applies actions, taking them from its queue one
+    at a time, so actions on a game are serialized without locks. Bot moves
+    run in an executor; while a bot thinks the state is only read, so
+    snapshots can still be served from the event loop.
+    """
+
+    def __init__(self, game_id, seed, state, bots, executor, max_queued):
+        self.game_id = game_id
+        self.seed = seed
+        self.state = state
+        self.bots = bots # per seat, None for a seat played through the server
+        self.executor = executor
+        self.max_queued = max_queued
+        self.action_ids = [] # for medici_records
+        self.queue = asyncio.Queue()
+        self.subscriptions = []
+        self.task = None
+
+    def Subscribe(self):
+        subscription = Subscription(self.state, self.max_queued)
+        if self.task is None or self.task.done():
+            subscription.Close(self.state)
+        else:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def Unsubscribe(self, subscription):
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+        subscription.Close(self.state)
+
+    def Apply(self, action):
+        for bot in self.bots:
+            if bot is not None:
+                bot.InformAction(self.state, action)
+        self.state.DoApplyAction(action)
+        self.action_ids.append(medici.encode_action(action))
+        for subscription in self.subscriptions:
+            subscription.Push(self.state)
+
+    def CheckAction(self, player, frontend_action):
+        state = self.state
+        if state.is_game_over:
+            raise ValueError("the game is over")
+        if not 0 <= player < len(self.bots):
+            raise ValueError(f"no player {player}")
+        if self.bots[player] is not None:
+            raise ValueError(f"player {player} is a bot")
+        if player != state.current_player:
+            raise ValueError(f"it is player {state.current_player}'s turn, not player {player}'s")
+        try:
+            action = state.from_frontend_action(frontend_action)
+        except (KeyError, TypeError):
+            action = None
+        if action is None or not state.IsLegalAction(action):
+            raise ValueError(f"illegal action {frontend_action}")
+        return action
+
+    async def PlayBots(self):
+        loop = asyncio.get_running_loop()
+        state = self.state
+        while not state.is_game_over and self.bots[state.current_player] is not None:
+            bot = self.bots[state.current_player]
+            action = await loop.run_in_executor(self.executor, bot.ChooseAction, state)
+            self.Apply(action)
+
+    async def Run(self):
+        try:
+            await self.PlayBots()
+            while True:
+                message = await self.queue.get()
+                if message is None:
+                    break
+                player, frontend_action, future = message
+                try:
+                    action = self.CheckAction(player, frontend_action)
+                except ValueError as e:
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+                self.Apply(action)
+                if not future.done():
+                    future.set_result(self.state.version)
+                await self.PlayBots()
+        finally:
+            # a failing bot ends the game, and nobody may wait on it forever
+            while not self.queue.empty():
+                message = self.queue.get_nowait()
+                if message is not None and not message[2].done():
+                    message[2].set_exception(ValueError(f"game {self.game_id} is closed"))
+            for subscription in self.subscriptions:
+                subscription.Close(self.state)
+            self.subscriptions = []
+
+
+class GameServer:
+    """Hosts many games in one event loop, each owned by its own task.
+
+    Seats are bot specs as in `medici_tournament.make_bot`, or None for a
+    seat whose actions come through `ApplyAction`. Bots run in `executor`,
+    the loop's default thread pool when None, so they do not block the
+    loop.
+    """
+
+    def __init__(self, game=None, executor=None, max_queued_updates=16):
+        if game is None:
+            game = medici.MediciGame(log_mode=medici.LogMode.Structured)
+        self.game = game
+        self.executor = executor
+        self.max_queued_updates = max_queued_updates
+        self.sessions = {}
+        self.next_game_id = 0
+
+    def Session(self, game_id):
+        try:
+            return self.sessions[game_id]
+        except KeyError:
+            raise KeyError(f"no game {game_id}") from None
+
+    async def CreateGame(self, seats, seed=None):
+        """Starts a game and returns its id. Bots start playing at once."""
+        if len(seats) != self.game.n_players:
+            raise ValueError(f"expected {self.game.n_players} seats, got {len(seats)}")
+        if seed is None:
+            seed = random.getrandbits(63)
+        # dealt like a tournament game, so the game replays from its seed
+        state = self.game.InitialState(random.Random(seed))
+        bots = [None if spec is None else medici_tournament.make_bot(spec, random.Random(f"{seed}/{player}"))
+                for player, spec in enumerate(seats)]
+
+        game_id = self.next_game_id
+        self.next_game_id += 1
+        session = GameSession(game_id, seed, state, bots, self.executor, self.max_queued_updates)
+        state.start_frontend_history()
+        session.task = asyncio.create_task(session.Run())
+        self.sessions[game_id] = session
+        return game_id
+
+    def FrontendState(self, game_id):
+        return self.Session(game_id).state.frontend_state()
+
+    def Subscribe(self, game_id):
+        return self.Session(game_id).Subscribe()
+
+    def Unsubscribe(self, game_id, subscription):
+        self.Session(game_id).Unsubscribe(subscription)
+
+    async def ApplyAction(self, game_id, player, frontend_action):
+        """Applies a frontend action for `player` and returns the state
+        version after it. Raises ValueError if the action is not legal."""
+        session = self.Session(game_id)
+        if session.task.done():
+            raise ValueError(f"game {game_id} is closed")
+        future = asyncio.get_running_loop().create_future()
+        session.queue.put_nowait((player, frontend_action, future))
+        return await future
+
+    async def CloseGame(self, game_id):
+        session = self.sessions.pop(game_id)
+        session.queue.put_nowait(None)
+        await session.task
+
+    async def Close(self):
+        for game_id in list(self.sessions):
+            await self.CloseGame(game_id)
+
+
+class GameClient:
+    """An in-process client for one seat that keeps a local snapshot up to
+    date from the pushed updates."""
+
+    def __init__(self, server, game_id, player):
+        self.server = server
+        self.game_id = game_id
+        self.player = player
+        self.subscription = server.Subscribe(game_id)
+        self.snapshot = None
+        self.min_version = 0 # the snapshot is stale until it reaches this
+
+    async def Update(self):
+        """Waits for the next update and returns the snapshot, or None once
+        the game is closed."""
+        diff = await self.subscription.Get()
+        if diff is None:
+            return None
+        self.snapshot = apply_frontend_diff(self.snapshot, diff)
+        return self.snapshot
+
+    async def WaitForTurn(self):
+        """Returns the snapshot once it is this seat's turn or the game is
+        over, or None if the game is closed first."""
+        snapshot = self.snapshot
+        while (snapshot is None or snapshot["version"] < self.min_version or
+               (not snapshot["is_game_over"] and snapshot["current_player"] != self.player)):
+            snapshot = await self.Update()
+            if snapshot is None:
+                return None
+        return snapshot
+
+    async def Act(self, frontend_action):
+        version = await self.server.ApplyAction(self.game_id, self.player, frontend_action)
+        self.min_version = version
+        return version
+
+    def Close(self):
+        self.server.Unsubscribe(self.game_id, self.subscription)
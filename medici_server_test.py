@@ -0,0 +1,103 @@
+import asyncio
+import random
+
+import pytest
+
+import medici_records
+import medici_server
+
+
+async def play_human_seat(server, game_id, player, rng):
+    client = medici_server.GameClient(server, game_id, player)
+    while True:
+        snapshot = await client.WaitForTurn()
+        if snapshot["is_game_over"]:
+            break
+        await client.Act(rng.choice(snapshot["legal_actions"]))
+    client.Close()
+    return snapshot
+
+
+def test_server_game():
+    async def main():
+        server = medici_server.GameServer()
+        game_id = await server.CreateGame([None, "random", None, "random"], seed=5)
+
+        with pytest.raises(ValueError):
+            await server.ApplyAction(game_id, 1, {"type": "draw", "value": "Draw"})
+        with pytest.raises(ValueError):
+            await server.ApplyAction(game_id, 2, {"type": "draw", "value": "Draw"})
+        with pytest.raises(ValueError):
+            await server.ApplyAction(game_id, 0, {"type": "bid", "value": 5})
+        with pytest.raises(ValueError):
+            await server.ApplyAction(game_id, 0, {"type": "draw", "value": "Steal"})
+
+        # a subscriber that never reads still catches up in one update
+        lagging = server.Subscribe(game_id)
+        snapshots = await asyncio.gather(
+            play_human_seat(server, game_id, 0, random.Random(0)),
+            play_human_seat(server, game_id, 2, random.Random(1)))
+        final = server.FrontendState(game_id)
+        assert snapshots[0] == snapshots[1] == final
+        assert final["is_game_over"]
+
+        snapshot = None
+        while lagging.queue.qsize():
+            snapshot = medici_server.apply_frontend_diff(snapshot, await lagging.Get())
+        assert snapshot == final
+
+        session = server.Session(game_id)
+        record = medici_records.GameRecord(session.seed, session.action_ids)
+        replayed = medici_records.replay(server.game, record)
+        assert replayed.ToString() == session.state.ToString()
+
+        await server.Close()
+        assert await lagging.Get() is None
+        with pytest.raises(KeyError):
+            server.FrontendState(game_id)
+
+    asyncio.run(main())
+
+
+def test_close_with_full_queue():
+    async def main():
+        server = medici_server.GameServer(max_queued_updates=2)
+        game_id = await server.CreateGame([None] * 4, seed=3)
+        lagging = server.Subscribe(game_id)
+        rng = random.Random(0)
+        # a full snapshot from the last collapse, then a diff
+        for _ in range(7):
+            state = server.FrontendState(game_id)
+            await server.ApplyAction(game_id, state["current_player"], rng.choice(state["legal_actions"]))
+        final = server.FrontendState(game_id)
+        assert lagging.queue.full()
+        await server.CloseGame(game_id)
+
+        # the backlog still applies from scratch, then the game ends
+        snapshot = None
+        while (diff := await lagging.Get()) is not None:
+            snapshot = medici_server.apply_frontend_diff(snapshot, diff)
+        assert snapshot == final
+
+    asyncio.run(main())
+
+
+def test_many_games():
+    async def main():
+        server = medici_server.GameServer(max_queued_updates=2)
+        game_ids = [await server.CreateGame([None] + ["random"] * 3, seed=seed)
+                    for seed in range(50)]
+        snapshots = await asyncio.gather(*[
+            play_human_seat(server, game_id, 0, random.Random(game_id))
+            for game_id in game_ids])
+        for game_id, snapshot in zip(game_ids, snapshots):
+            assert snapshot == server.FrontendState(game_id)
+        await server.Close()
+
+    asyncio.run(main())
+
+
+if __name__ == "__main__":
+    test_server_game()
+    test_close_with_full_queue()
+    test_many_games()
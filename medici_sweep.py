@@ -0,0 +1,278 @@
+import argparse
+import ast
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import medici
+import medici_tournament
+
+
+def parse_spec(text):
+    """The inverse of `medici_tournament.bot_label`: "name" or
+    "name(key=value,...)" with Python literal values."""
+    if "(" not in text:
+        return text
+    name, args = text.split("(", 1)
+    if not args.endswith(")"):
+        raise ValueError(f"bad bot spec {text!r}")
+    call = ast.parse(f"f({args}", mode="eval").body
+    if call.args:
+        raise ValueError(f"bot spec {text!r} must only have keyword arguments")
+    return name, {keyword.arg: ast.literal_eval(keyword.value) for keyword in call.keywords}
+
+
+def spec_from_json(spec):
+    return spec if isinstance(spec, str) else (spec[0], dict(spec[1]))
+
+
+class Candidate:
+    """Results so far for one bot configuration, each game played in one
+    seat against the sweep's opponents."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.label = medici_tournament.bot_label(spec)
+        self.done = set() # indices of the games played
+        self.wins = 0
+        self.money = 0
+        self.alive = True
+
+    @property
+    def games(self):
+        return len(self.done)
+
+    def win_rate(self):
+        return self.wins / self.games if self.games else 0.0
+
+    def to_json(self):
+        return {
+            "spec": self.spec,
+            "done": sorted(self.done),
+            "wins": self.wins,
+            "money": self.money,
+            "alive": self.alive,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        candidate = cls(spec_from_json(data["spec"]))
+        candidate.done = set(data["done"])
+        candidate.wins = data["wins"]
+        candidate.money = data["money"]
+        candidate.alive = data["alive"]
+        return candidate
+
+
+def play_sweep_games(jobs):
+    # jobs are (candidate, index, seed, seat, bot_specs); like
+    # `medici_tournament.play_games`, workers only see seeds and specs
+    return [(candidate, seat, medici_tournament.play_game(index, seed, bot_specs))
+            for candidate, index, seed, seat, bot_specs in jobs]
+
+
+class Sweep:
+    """Races bot configurations against fixed opponents by successive
+    halving.
+
+    Round r plays every surviving candidate up to `first_round_games * 2**r`
+    games, interleaved across candidates in worker processes. Game i uses
+    the same seed and seat for every candidate, so candidates are compared
+    on the same deals. At the end of a round, candidates whose Wilson upper
+    bound is below the leader's lower bound are dropped, then all but the
+    best `keep_fraction` of the rest. Candidates are only ever dropped at
+    round ends, so the outcome does not depend on the order in which
+    workers finish.
+
+    With a `checkpoint` path, progress is saved there as JSON and a sweep
+    created with the same path picks up where it stopped.
+    """
+
+    def __init__(self, specs, checkpoint=None, opponent="random", base_seed=0,
+                 first_round_games=32, max_rounds=8, keep_fraction=0.5, z=1.96):
+        self.checkpoint = checkpoint
+        self.opponent = opponent
+        self.base_seed = base_seed
+        self.first_round_games = first_round_games
+        self.max_rounds = max_rounds
+        self.keep_fraction = keep_fraction
+        self.z = z
+        self.n_players = medici.MediciGame(log_mode=medici.LogMode.Off).n_players
+        self.round = 0
+        self.candidates = [Candidate(spec) for spec in specs]
+        if len({candidate.label for candidate in self.candidates}) != len(self.candidates):
+            raise ValueError("candidate specs must be distinct")
+        if checkpoint is not None and os.path.exists(checkpoint):
+            self.Load()
+
+    def config(self):
+        return {
+            "opponent": self.opponent,
+            "base_seed": self.base_seed,
+            "first_round_games": self.first_round_games,
+            "keep_fraction": self.keep_fraction,
+            "z": self.z,
+        }
+
+    def Load(self):
+        with open(self.checkpoint) as f:
+            data = json.load(f)
+        candidates = [Candidate.from_json(entry) for entry in data["candidates"]]
+        if (data["config"] != json.loads(json.dumps(self.config())) or
+                [c.label for c in candidates] != [c.label for c in self.candidates]):
+            raise ValueError(f"{self.checkpoint} was written by a different sweep")
+        self.round = data["round"]
+        self.candidates = candidates
+
+    def Save(self):
+        if self.checkpoint is None:
+            return
+        data = {
+            "config": self.config(),
+            "round": self.round,
+            "candidates": [candidate.to_json() for candidate in self.candidates],
+        }
+        # written aside and renamed, so a crash never leaves a torn file
+        path = self.checkpoint + ".tmp"
+        with open(path, "w") as f:
+            json.dump(data, f)
+        os.replace(path, self.checkpoint)
+
+    def alive(self):
+        return [candidate for candidate in self.candidates if candidate.alive]
+
+    def is_finished(self):
+        return len(self.alive()) <= 1 or self.round >= self.max_rounds
+
+    def round_games(self):
+        return self.first_round_games << self.round
+
+    def jobs(self):
+        """The games the current round still needs, one game index at a
+        time across all surviving candidates."""
+        for index in range(self.round_games()):
+            seed = medici_tournament.game_seed(self.base_seed, index)
+            seat = index % self.n_players
+            for i, candidate in enumerate(self.candidates):
+                if candidate.alive and index not in candidate.done:
+                    bot_specs = [self.opponent] * self.n_players
+                    bot_specs[seat] = candidate.spec
+                    yield (i, index, seed, seat, bot_specs)
+
+    def Record(self, i, seat, result):
+        candidate = self.candidates[i]
+        candidate.done.add(result.index)
+        candidate.wins += result.winner == seat
+        candidate.money += result.money[seat]
+
+    def EndRound(self):
+        alive = self.alive()
+        bounds = [medici_tournament.wilson_interval(c.wins, c.games, self.z) for c in alive]
+        best_low = max(low for low, _ in bounds)
+        survivors = [c for c, (_, high) in zip(alive, bounds) if high >= best_low]
+        survivors.sort(key=Candidate.win_rate, reverse=True)
+        kept = survivors[:max(1, math.ceil(len(alive) * self.keep_fraction))]
+        for candidate in alive:
+            candidate.alive = candidate in kept
+        self.round += 1
+
+    def Run(self, max_workers=None, games_per_task=8, time_budget=None,
+            max_games=None, checkpoint_every=64, report=None):
+        """Plays rounds until one candidate is left, `max_rounds` are done,
+        `time_budget` seconds have passed or `max_games` games have been
+        played, saving the checkpoint along the way. Returns the ranking."""
+        start = time.perf_counter()
+        max_workers = max_workers or os.cpu_count() or 1
+        max_pending = 4 * max_workers
+        n_played = 0
+
+        def out_of_budget():
+            if max_games is not None and n_played >= max_games:
+                return True
+            return time_budget is not None and time.perf_counter() - start >= time_budget
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            while not self.is_finished():
+                job_iter = self.jobs()
+                pending = set()
+                n_submitted = 0
+                since_save = 0
+                while True:
+                    while len(pending) < max_pending and not out_of_budget():
+                        budget = games_per_task
+                        if max_games is not None:
+                            budget = min(budget, max_games - n_played - n_submitted)
+                        task = [job for _, job in zip(range(budget), job_iter)]
+                        if not task:
+                            break
+                        n_submitted += len(task)
+                        pending.add(executor.submit(play_sweep_games, task))
+                    if not pending:
+                        break
+
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results = future.result()
+                        for i, seat, result in results:
+                            self.Record(i, seat, result)
+                        n_submitted -= len(results)
+                        n_played += len(results)
+                        since_save += len(results)
+                    if since_save >= checkpoint_every:
+                        self.Save()
+                        since_save = 0
+
+                if any(candidate.alive and len(candidate.done) < self.round_games()
+                       for candidate in self.candidates):
+                    break # out of budget mid-round
+                self.EndRound()
+                self.Save()
+                if report is not None:
+                    report(self)
+        self.Save()
+        return self.Ranking()
+
+    def Ranking(self):
+        """Candidates, survivors first, each group by win rate."""
+        return sorted(self.candidates, key=lambda c: (c.alive, c.games, c.win_rate()), reverse=True)
+
+    def ToString(self):
+        s = f"Round: {self.round}\n"
+        for candidate in self.Ranking():
+            low, high = medici_tournament.wilson_interval(candidate.wins, candidate.games, self.z)
+            mean_money = candidate.money / candidate.games if candidate.games else 0.0
+            status = "" if candidate.alive else " (dropped)"
+            s += (f"{candidate.label}: {candidate.games} games, win rate {candidate.win_rate():.4f} "
+                  f"[{low:.4f}, {high:.4f}], mean money {mean_money:.1f}{status}\n")
+        return s
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune Medici bot parameters by successive halving.")
+    parser.add_argument("checkpoint", help="JSON file for resumable progress")
+    parser.add_argument("candidates", nargs="+",
+                        help='bot specs, e.g. "ismcts(time_limit=0.05,exploration=0.5)"')
+    parser.add_argument("--opponent", default="random", help="bot spec for the other seats")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--first-round-games", type=int, default=32)
+    parser.add_argument("--max-rounds", type=int, default=8)
+    parser.add_argument("--keep-fraction", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--hours", type=float, default=None, help="stop after this much time")
+    args = parser.parse_args()
+
+    sweep = Sweep([parse_spec(text) for text in args.candidates], args.checkpoint,
+                  opponent=parse_spec(args.opponent), base_seed=args.seed,
+                  first_round_games=args.first_round_games, max_rounds=args.max_rounds,
+                  keep_fraction=args.keep_fraction)
+    time_budget = None if args.hours is None else 3600 * args.hours
+    sweep.Run(args.workers, time_budget=time_budget,
+              report=lambda sweep: print(sweep.ToString(), flush=True))
+    if not sweep.is_finished():
+        print(sweep.ToString())
+
+
+if __name__ == "__main__":
+    main()
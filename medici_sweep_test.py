@@ -0,0 +1,43 @@
+import medici_sweep
+import medici_tournament
+
+
+def test_parse_spec():
+    assert medici_sweep.parse_spec("random") == "random"
+    spec = medici_sweep.parse_spec("ismcts(exploration=0.5,max_iterations=20,time_limit=None)")
+    assert spec == ("ismcts", {"exploration": 0.5, "max_iterations": 20, "time_limit": None})
+    assert medici_tournament.bot_label(spec) == "ismcts(exploration=0.5,max_iterations=20,time_limit=None)"
+
+
+def test_sweep_resumes(tmp_path):
+    specs = [
+        "random",
+        ("ismcts", {"max_iterations": 1, "time_limit": None}),
+        ("ismcts", {"max_iterations": 3, "time_limit": None}),
+    ]
+    options = dict(first_round_games=4, max_rounds=2)
+
+    full = medici_sweep.Sweep(specs, **options)
+    full.Run(max_workers=2, games_per_task=2)
+    assert full.round == 2
+    assert len(full.alive()) == 1
+    # round 0 plays everyone 4 games, round 1 the best two 8
+    assert sorted(c.games for c in full.candidates) == [4, 8, 8]
+
+    # stopped part way through and resumed from the checkpoint, the sweep
+    # plays the same games and keeps the same candidates
+    path = str(tmp_path / "sweep.json")
+    partial = medici_sweep.Sweep(specs, path, **options)
+    partial.Run(max_workers=2, games_per_task=2, max_games=7)
+    assert partial.round == 0
+    assert sum(c.games for c in partial.candidates) == 7
+
+    resumed = medici_sweep.Sweep(specs, path, **options)
+    assert sum(c.games for c in resumed.candidates) == 7
+    resumed.Run(max_workers=2, games_per_task=2)
+    assert ([c.to_json() for c in resumed.candidates] ==
+            [c.to_json() for c in full.candidates])
+
+
+if __name__ == "__main__":
+    test_parse_spec()
@@ -1,6 +1,11 @@
+import copy
 import medici
+import medici_ismcts
+import medici_server
 import random
 
+import pytest
+
 def test_random_playouts(n_tests = 100):
     game = medici.MediciGame()
 
@@ -16,6 +21,306 @@ def test_random_playouts(n_tests = 100):
         print(state.ToString())
 
 
+def test_clone():
+    game = medici.MediciGame()
+
+    for i in range(20):
+        state = game.InitialState()
+        for _ in range(random.randrange(1, 60)):
+            state.DoApplyAction(random.choice(state.LegalActions()))
+        before = state.ToString()
+
+        clone = state.Clone()
+        assert clone.ToString() == before
+        assert clone.logs == []
+
+        while not clone.IsTerminal():
+            clone.DoApplyAction(random.choice(clone.LegalActions()))
+        assert state.ToString() == before
+
+
+def play_seeded_game(game, rng, bot_rngs):
+    state = game.InitialState(rng)
+    bots = [medici.RandomBot(bot_rng) for bot_rng in bot_rngs]
+    while not state.IsTerminal():
+        state.DoApplyAction(bots[state.current_player].ChooseAction(state))
+    return state
+
+
+def test_injected_rng():
+    game = medici.MediciGame()
+
+    for seed in range(10):
+        states = [
+            play_seeded_game(game, random.Random(seed),
+                             [random.Random(seed * 4 + i) for i in range(4)])
+            for _ in range(2)
+        ]
+        assert states[0].ToString() == states[1].ToString()
+        assert states[0].logs == states[1].logs
+
+    np = pytest.importorskip("numpy")
+    states = [
+        play_seeded_game(game, np.random.default_rng(3),
+                         [np.random.default_rng(i) for i in range(4)])
+        for _ in range(2)
+    ]
+    assert states[0].logs == states[1].logs
+
+
+def test_running_totals():
+    game = medici.MediciGame()
+    rng = random.Random(2)
+
+    for i in range(20):
+        state = game.InitialState(rng)
+        while not state.IsTerminal():
+            state.DoApplyAction(rng.choice(state.LegalActions()))
+            assert state.ship_values == [sum(card.value for card in ship) for ship in state.ships]
+            assert state.n_full_ships == sum(len(ship) >= game.kShipCapacity for ship in state.ships)
+            for resource, pyramid in enumerate(state.pyramids):
+                assert state.pyramid_top[resource] == max(pyramid)
+                below_top = [count for count in pyramid if count != max(pyramid)]
+                assert state.pyramid_second[resource] == max(below_top, default=0)
+
+
+def test_sample_legal_action():
+    game = medici.MediciGame()
+    assert medici.bid_action(7) is medici.bid_action(7)
+
+    for seed in range(10):
+        # sampling consumes the rng exactly like choosing from LegalActions
+        state = game.InitialState(random.Random(seed))
+        listed = game.InitialState(random.Random(seed))
+        sample_rng = random.Random(seed + 100)
+        list_rng = random.Random(seed + 100)
+        while not state.IsTerminal():
+            legal_actions = state.LegalActions()
+            if state.phase == medici.Phase.Bid:
+                min_bid, max_bid, can_pass = state.BidRange()
+                bids = [medici.BidAction(i) for i in range(min_bid, max_bid + 1)]
+                assert legal_actions == bids + [medici.BidAction(0)]
+                assert can_pass
+
+            assert all(state.IsLegalAction(action) for action in legal_actions)
+            illegal = [medici.DrawAction.Draw, medici.DrawAction.Pass,
+                       medici.BidAction(state.money[state.current_player] + 1)]
+            for action in illegal:
+                assert state.IsLegalAction(action) == (action in legal_actions)
+
+            action = state.SampleLegalAction(sample_rng)
+            assert action in legal_actions
+            assert action == list_rng.choice(listed.LegalActions())
+            state.DoApplyAction(action)
+            listed.DoApplyAction(action)
+
+
+def test_zobrist_hash():
+    game = medici.MediciGame()
+    rng = random.Random(3)
+
+    for i in range(10):
+        state = game.InitialState(rng)
+        while not state.IsTerminal():
+            state.DoApplyAction(rng.choice(state.LegalActions()))
+            assert state.zobrist == state.ComputeZobrist()
+
+            # the hidden deck order is not part of the position
+            shuffled = state.Clone()
+            rng.shuffle(shuffled.deck)
+            assert shuffled.ZobristHash() == state.ZobristHash()
+
+    state = game.InitialState(rng)
+    passed = state.Clone()
+    passed.DoApplyAction(medici.DrawAction.Pass)
+    assert passed.ZobristHash() != state.ZobristHash()
+
+
+def test_transposition_table():
+    table = medici.TranspositionTable(capacity=2)
+    table.Store(1, "a")
+    table.Store(2, "b")
+    assert table.Lookup(1) == "a"
+    table.Store(3, "c")
+    assert len(table) == 2
+    assert table.Lookup(2) is None
+    assert table.Lookup(1) == "a"
+    assert table.Lookup(3) == "c"
+
+
+def test_log_modes():
+    games = {mode: medici.MediciGame(log_mode=mode) for mode in medici.LogMode}
+
+    for seed in range(20):
+        states = {
+            mode: play_seeded_game(game, random.Random(seed),
+                                   [random.Random(seed * 4 + i) for i in range(4)])
+            for mode, game in games.items()
+        }
+        text = states[medici.LogMode.Text]
+        structured = states[medici.LogMode.Structured]
+        off = states[medici.LogMode.Off]
+        assert structured.ToString() == text.ToString() == off.ToString()
+
+        assert structured.logs == []
+        assert structured.LogLength() == len(text.logs)
+        assert structured.LogLines() == text.logs
+        assert structured.LogLines(10) == text.logs[10:]
+        assert structured.frontend_state()["logs"] == text.frontend_state()["logs"]
+
+        assert off.LogLength() == 0
+        assert off.logs == [] and off.events is None
+
+
+def test_instrumentation():
+    instrumentation = medici.Instrumentation()
+    game = medici.MediciGame(instrumentation=instrumentation)
+    assert type(medici.MediciGame().InitialState()) is medici.MediciState
+
+    for seed in range(5):
+        state = play_seeded_game(game, random.Random(seed), [random.Random(seed * 4 + i) for i in range(4)])
+        plain = play_seeded_game(medici.MediciGame(), random.Random(seed),
+                                 [random.Random(seed * 4 + i) for i in range(4)])
+        assert state.ToString() == plain.ToString()
+        state.frontend_state()
+
+    snapshot = instrumentation.snapshot()
+    n_actions = sum(snapshot["actions_per_phase"].values())
+    assert snapshot["timings"]["DoApplyAction"]["count"] == n_actions
+    assert snapshot["actions_per_phase"]["GameOver"] == 0
+    assert snapshot["days"] == 5 * game.n_days
+    assert snapshot["auctions"] >= snapshot["days"]
+    assert snapshot["ship_fills"] <= snapshot["days"]
+    assert snapshot["timings"]["DoScoring"]["count"] == snapshot["days"]
+    assert snapshot["timings"]["frontend_state"]["count"] == 5
+    timing = snapshot["timings"]["LegalActions"]
+    assert timing["p50_ns"] <= timing["p99_ns"]
+    assert sum(timing["buckets"].values()) == timing["count"] > 0
+
+    instrumentation.Reset()
+    assert instrumentation.snapshot()["auctions"] == 0
+
+    # searches work on clones, which are not instrumented
+    state = game.InitialState(random.Random(0))
+    state.DoApplyAction(state.LegalActions()[0])
+    before = instrumentation.snapshot()
+    assert type(state.Clone()) is medici.MediciState
+    medici_ismcts.ISMCTSBot(random.Random(0), time_limit=None, max_iterations=20).ChooseAction(state)
+    after = instrumentation.snapshot()
+    for key in ["actions_per_phase", "auctions", "ship_fills", "days"]:
+        assert after[key] == before[key]
+    assert after["timings"]["DoApplyAction"]["count"] == before["timings"]["DoApplyAction"]["count"]
+
+
+def test_frontend_state_since():
+    game = medici.MediciGame()
+    state = game.InitialState(random.Random(0))
+    bot = medici.RandomBot(random.Random(1))
+
+    client = state.frontend_state()
+    assert client is state.frontend_state()
+    n_diffs = 0
+    while not state.IsTerminal():
+        for _ in range(random.randrange(1, 4)):
+            if not state.IsTerminal():
+                state.DoApplyAction(bot.ChooseAction(state))
+        diff = state.frontend_state_since(client["version"])
+        n_diffs += not diff["full"]
+        client = medici_server.apply_frontend_diff(client, diff)
+        assert client == state.frontend_state()
+
+    assert n_diffs > 0
+    assert state.frontend_state_since(state.version)["players"] == []
+
+
+def test_deck_belief():
+    game = medici.MediciGame(log_mode=medici.LogMode.Off)
+    rng = random.Random(4)
+    for _ in range(5):
+        state = game.InitialState(rng)
+        while not state.IsTerminal():
+            belief = medici.DeckBelief(state, state.current_player)
+            counts = [state.deck.count(card) for card in game.card_kinds]
+            assert belief.Counts() == counts
+            if state.deck:
+                mean = sum(card.value for card in state.deck) / len(state.deck)
+                assert belief.ExpectedNextValue() == pytest.approx(mean)
+                card = state.deck[-1]
+                assert belief.Probability(card) == state.deck.count(card) / len(state.deck)
+            assert sorted(belief.SampleDeck(rng)) == sorted(state.deck)
+            state.DoApplyAction(rng.choice(state.LegalActions()))
+
+
+def state_snapshot(state):
+    # everything UndoAction restores, deep-copied
+    skip = ("game", "rng", "journal", "events", "frontend_history", "frontend_cache")
+    snapshot = {name: copy.deepcopy(getattr(state, name))
+                for name in medici.MediciState.__slots__ if name not in skip}
+    snapshot["log_lines"] = state.LogLines()
+    return snapshot
+
+
+def test_undo_action():
+    for log_mode in [medici.LogMode.Text, medici.LogMode.Structured]:
+        game = medici.MediciGame(log_mode=log_mode)
+        rng = random.Random(5)
+        for _ in range(5):
+            state = game.InitialState(random.Random(rng.random()))
+            state.StartJournal()
+            snapshots = []
+            while not state.IsTerminal():
+                snapshots.append(state_snapshot(state))
+                state.DoApplyAction(rng.choice(state.LegalActions()))
+                # take back a few actions now and then, across day ends too
+                if rng.random() < 0.1:
+                    for _ in range(rng.randint(1, min(5, len(snapshots)))):
+                        state.UndoAction()
+                        assert state_snapshot(state) == snapshots.pop()
+                        assert state.zobrist == state.ComputeZobrist()
+
+            while state.CanUndo():
+                state.UndoAction()
+                assert state_snapshot(state) == snapshots.pop()
+            assert snapshots == []
+            with pytest.raises(ValueError):
+                state.UndoAction()
+
+
+def test_rules_validation():
+    for bad in [dict(n_players=1), dict(n_players=7), dict(ship_capacity=0),
+                dict(max_lot_size=6), dict(n_days=0), dict(resource_values=()),
+                dict(ship_value_rewards=(30, 20)), dict(pyramid_bonuses=(5, -10, 20))]:
+        with pytest.raises(ValueError):
+            medici.MediciRules(**bad)
+
+    rules = medici.MediciRules()
+    with pytest.raises(AttributeError):
+        rules.n_players = 5
+    assert rules == medici.default_rules
+    # derived tables are built once and shared between games
+    assert medici.MediciGame().zobrist is medici.MediciGame().zobrist
+
+
+def test_variants():
+    for rules in [medici.MediciRules(n_players=2), medici.MediciRules(n_players=3, ship_capacity=4),
+                  medici.MediciRules(n_players=5, max_lot_size=2),
+                  medici.MediciRules(n_players=6, ship_capacity=6, max_lot_size=4, n_days=2)]:
+        game = medici.MediciGame(rules)
+        rng = random.Random(rules.n_players)
+        for _ in range(20):
+            state = game.InitialState(rng)
+            assert len(state.money) == rules.n_players
+            assert state.frontend_state()["ship_capacity"] == rules.ship_capacity
+            while not state.IsTerminal():
+                action = rng.choice(state.LegalActions())
+                assert 0 <= medici.encode_action(action) < game.num_distinct_actions
+                state.DoApplyAction(action)
+                assert len(state.cards_in_play) <= rules.max_lot_size
+                assert state.zobrist == state.ComputeZobrist()
+            assert state.day == rules.n_days - 1
+            assert len(state.observation_tensor(0)) == game.observation_size
+
+
 def test_medici():
     test_random_playouts()
 
@@ -0,0 +1,203 @@
+import argparse
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import NamedTuple, Tuple
+
+import medici
+import medici_ismcts
+import medici_records
+
+
+BOTS = {
+    "random": medici.RandomBot,
+    "ismcts": medici_ismcts.ISMCTSBot,
+}
+
+
+def make_bot(spec, rng=None):
+    """Builds a bot from a spec: a registered name or a (name, kwargs) pair."""
+    if isinstance(spec, str):
+        return BOTS[spec](rng=rng)
+    name, kwargs = spec
+    return BOTS[name](rng=rng, **kwargs)
+
+
+def bot_label(spec):
+    if isinstance(spec, str):
+        return spec
+    name, kwargs = spec
+    if not kwargs:
+        return name
+    args = ",".join(f"{key}={value}" for key, value in sorted(kwargs.items()))
+    return f"{name}({args})"
+
+
+class GameResult(NamedTuple):
+    index: int
+    seed: int
+    seats: Tuple[str, ...] # bot label per player
+    winner: int
+    money: Tuple[int, ...]
+    days: int
+    action_ids: Tuple[int, ...] # the game replays from its seed and these
+
+
+def game_seed(base_seed, index):
+    return base_seed * 1_000_003 + index
+
+
+def seat_specs(bot_specs, index, rotate_seats):
+    if not rotate_seats:
+        return list(bot_specs)
+    shift = index % len(bot_specs)
+    return list(bot_specs[shift:]) + list(bot_specs[:shift])
+
+
+def play_game(index, seed, bot_specs):
+    # the deal depends only on the seed, whatever the bots do
+    game = medici.MediciGame(log_mode=medici.LogMode.Off)
+    state = game.InitialState(random.Random(seed))
+    bots = [make_bot(spec, random.Random(f"{seed}/{player}"))
+            for player, spec in enumerate(bot_specs)]
+    action_ids = []
+
+    while not state.IsTerminal():
+        action = bots[state.current_player].ChooseAction(state)
+        for bot in bots:
+            bot.InformAction(state, action)
+        state.DoApplyAction(action)
+        action_ids.append(medici.encode_action(action))
+
+    return GameResult(
+        index=index,
+        seed=seed,
+        seats=tuple(bot_label(spec) for spec in bot_specs),
+        winner=state.winner,
+        money=tuple(state.money),
+        days=state.day + 1,
+        action_ids=tuple(action_ids),
+    )
+
+
+def play_games(jobs):
+    # jobs are (index, seed, bot_specs) triples; workers only ever see seeds
+    # and specs, never pickled states
+    return [play_game(*job) for job in jobs]
+
+
+def run_tournament(bot_specs, n_games, base_seed=0, max_workers=None,
+                   games_per_task=16, rotate_seats=True):
+    """Plays `n_games` in worker processes, yielding each `GameResult`.
+
+    Results are yielded as tasks finish, so they are not in index order.
+    Only a bounded number of tasks is in flight at a time, so this can be
+    used for very long runs.
+    """
+    def jobs():
+        for index in range(n_games):
+            yield (index, game_seed(base_seed, index),
+                   seat_specs(bot_specs, index, rotate_seats))
+
+    job_iter = jobs()
+
+    def next_task():
+        task = []
+        for job in job_iter:
+            task.append(job)
+            if len(task) == games_per_task:
+                break
+        return task
+
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = 4 * max_workers
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        while True:
+            while len(pending) < max_pending:
+                task = next_task()
+                if not task:
+                    break
+                pending.add(executor.submit(play_games, task))
+            if not pending:
+                break
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+
+def wilson_interval(wins, games, z=1.96):
+    if games == 0:
+        return 0.0, 1.0
+    p = wins / games
+    denominator = 1 + z * z / games
+    center = (p + z * z / (2 * games)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+class TournamentStats:
+    """Win counts per bot label, updated one result at a time."""
+
+    def __init__(self):
+        self.n_games = 0
+        self.games = {}
+        self.wins = {}
+        self.money = {}
+
+    def update(self, result):
+        self.n_games += 1
+        for player, label in enumerate(result.seats):
+            self.games[label] = self.games.get(label, 0) + 1
+            self.money[label] = self.money.get(label, 0) + result.money[player]
+        winner_label = result.seats[result.winner]
+        self.wins[winner_label] = self.wins.get(winner_label, 0) + 1
+
+    def win_rates(self):
+        """Maps each label to (win rate, 95% low, 95% high) per seat played."""
+        rates = {}
+        for label, games in self.games.items():
+            wins = self.wins.get(label, 0)
+            low, high = wilson_interval(wins, games)
+            rates[label] = (wins / games, low, high)
+        return rates
+
+    def ToString(self):
+        s = f"Games: {self.n_games}\n"
+        for label, (rate, low, high) in sorted(self.win_rates().items()):
+            mean_money = self.money[label] / self.games[label]
+            s += f"{label}: win rate {rate:.4f} [{low:.4f}, {high:.4f}], mean money {mean_money:.1f}\n"
+        return s
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a Medici bot tournament.")
+    parser.add_argument("bots", nargs="+", help="bot name for each seat")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--report-every", type=int, default=1000)
+    parser.add_argument("--record", default=None, help="append the games to this record file")
+    args = parser.parse_args()
+
+    writer = None
+    if args.record:
+        writer = medici_records.GameRecordWriter(args.record, medici.MediciGame())
+
+    stats = TournamentStats()
+    for result in run_tournament(args.bots, args.games, args.seed, args.workers):
+        stats.update(result)
+        if writer is not None:
+            writer.write(result.seed, result.action_ids)
+        if stats.n_games % args.report_every == 0:
+            print(stats.ToString(), flush=True)
+    if writer is not None:
+        writer.close()
+    print(stats.ToString())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import medici_tournament
+
+
+def test_tournament():
+    bots = ["random"] * 4
+    results = list(medici_tournament.run_tournament(
+        bots, 20, base_seed=7, max_workers=2, games_per_task=3))
+    assert sorted(result.index for result in results) == list(range(20))
+
+    # games are reproducible from their seed alone
+    for result in results[:5]:
+        replayed = medici_tournament.play_game(result.index, result.seed, bots)
+        assert replayed == result
+
+    stats = medici_tournament.TournamentStats()
+    for result in results:
+        stats.update(result)
+    rate, low, high = stats.win_rates()["random"]
+    assert rate == 0.25
+    assert low < rate < high
+
+
+if __name__ == "__main__":
+    test_tournament()